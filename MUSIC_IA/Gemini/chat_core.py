@@ -1,7 +1,13 @@
 import streamlit as st
-import ollama
 import sqlite3
 import time
+import os
+import sys
+
+# Backend LLM e memoria chat condivisi della root del progetto (Ollama o fake, riassunto rolling)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+import llm_backend
+from memory_logic import init_memory, chat_memory, schedule_fold, fold_error, clear_memory
 
 # --- CONFIGURAZIONE ---
 st.set_page_config(page_title="YANGKIDD CHAT CORE", page_icon="🧠", layout="centered")
@@ -17,8 +23,13 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- DATABASE MANAGER (MEMORIA ETERNA) ---
+CHAT_DB = 'yangkidd_chat.db'
+SESSION = 'MAIN'
+HISTORY = (CHAT_DB, "messages")  # storia per memory_logic: riassunti in chat_summaries dello stesso DB
+HISTORY_SHOWN = 50  # messaggi ricaricati a video all'avvio
+
 def init_chat_db():
-    conn = sqlite3.connect('yangkidd_chat.db')
+    conn = sqlite3.connect(CHAT_DB)
     c = conn.cursor()
     # Tabella per salvare la cronologia
     c.execute('''CREATE TABLE IF NOT EXISTS messages
@@ -26,34 +37,39 @@ def init_chat_db():
                   role TEXT, 
                   content TEXT, 
                   timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    # Sessione per la memoria condivisa: i messaggi esistenti vanno nella sessione principale
+    if 'session_id' not in [r[1] for r in c.execute("PRAGMA table_info(messages)")]:
+        c.execute(f"ALTER TABLE messages ADD COLUMN session_id TEXT DEFAULT '{SESSION}'")
     conn.commit()
     conn.close()
+    init_memory(CHAT_DB)
 
 def save_message(role, content):
-    conn = sqlite3.connect('yangkidd_chat.db')
+    conn = sqlite3.connect(CHAT_DB)
     c = conn.cursor()
     c.execute("INSERT INTO messages (role, content) VALUES (?, ?)", (role, content))
     conn.commit()
     conn.close()
 
 def load_history():
-    conn = sqlite3.connect('yangkidd_chat.db')
+    conn = sqlite3.connect(CHAT_DB)
     # Carica gli ultimi 50 messaggi per dare contesto ma non intasare
     messages = []
     cursor = conn.cursor()
-    cursor.execute("SELECT role, content FROM messages ORDER BY id ASC")
+    cursor.execute("SELECT role, content FROM messages ORDER BY id DESC LIMIT ?", (HISTORY_SHOWN,))
     rows = cursor.fetchall()
     conn.close()
     
-    # Trasforma le righe del DB in dizionari per la sessione
-    for row in rows:
+    # Trasforma le righe del DB in dizionari per la sessione (dal più vecchio)
+    for row in reversed(rows):
         messages.append({"role": row[0], "content": row[1]})
     return messages
 
 def clear_history():
-    conn = sqlite3.connect('yangkidd_chat.db')
+    conn = sqlite3.connect(CHAT_DB)
     c = conn.cursor()
     c.execute("DELETE FROM messages")
+    clear_memory(c, SESSION)
     conn.commit()
     conn.close()
 
@@ -61,14 +77,13 @@ def clear_history():
 init_chat_db()
 
 # --- MOTORE AI ---
-MODEL = "mistral-nemo" # Assicurati di averlo installato
+MODEL = llm_backend.DEFAULT_MODEL # mistral-nemo se ENTERPRISE_LLM_MODEL non è impostata
 
 def stream_ai_response(messages):
-    """Chiama Ollama e genera risposta in streaming"""
+    """Chiama il backend LLM (Ollama di default) e genera risposta in streaming"""
     try:
-        stream = ollama.chat(model=MODEL, messages=messages, stream=True)
-        for chunk in stream:
-            yield chunk['message']['content']
+        for chunk in llm_backend.stream(MODEL, messages):
+            yield chunk
     except Exception as e:
         yield f"⚠️ Errore AI: {str(e)}. Controlla che Ollama sia aperto."
 
@@ -87,6 +102,8 @@ if "messages" not in st.session_state or len(st.session_state.messages) == 0:
     else:
         st.session_state.messages = history
 
+if err := fold_error(SESSION): st.warning(f"Memoria della chat non aggiornata: {err}")
+
 # 2. Visualizza la chat (FIX DELL'ERRORE PRECEDENTE)
 # Qui usiamo msg['content'] perché siamo sicuri che sia un dizionario, non un oggetto
 for msg in st.session_state.messages:
@@ -108,9 +125,12 @@ if prompt := st.chat_input("Scrivi qui la tua strategia..."):
         full_response = ""
         
         # Prepara il contesto per l'AI (aggiungiamo un system prompt invisibile)
+        # Solo gli ultimi messaggi + il riassunto dei precedenti, dal DB con gli stessi id: il prompt non cresce con la storia
+        summary, recent = chat_memory(SESSION, history=HISTORY)
         context_messages = [
             {"role": "system", "content": "Sei un Manager Discografico esperto e spietato. Parli italiano. Sei focalizzato su: numeri, ROI, strategie di crescita aggressive e analisi dati. Non dare risposte generiche. Se non sai un dato, chiedilo. Rispondi in modo conciso."}
-        ] + st.session_state.messages # Aggiunge tutta la storia recente
+        ] + ([{"role": "system", "content": f"MEMORIA DELLA CONVERSAZIONE (turni precedenti):\n{summary}"}] if summary else []) \
+          + recent
         
         # Streaming
         for chunk in stream_ai_response(context_messages):
@@ -122,6 +142,7 @@ if prompt := st.chat_input("Scrivi qui la tua strategia..."):
     # C. Salva risposta AI
     st.session_state.messages.append({"role": "assistant", "content": full_response})
     save_message("assistant", full_response) # Salva nel DB
+    schedule_fold(SESSION, history=HISTORY) # riassunto in coda, priorità bassa
 
 # --- SIDEBAR PER GESTIONE ---
 with st.sidebar:
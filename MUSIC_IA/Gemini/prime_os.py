@@ -1,5 +1,4 @@
 import streamlit as st
-import ollama
 import pandas as pd
 import sqlite3
 import plotly.express as px
@@ -7,6 +6,14 @@ import plotly.graph_objects as go
 from duckduckgo_search import DDGS
 from datetime import datetime, timedelta
 import time
+import os
+import sys
+import hashlib
+
+# Moduli condivisi della root del progetto (backend LLM, cache risposte)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+import llm_cache_logic as llm_cache
+import llm_backend
 
 # --- CONFIGURAZIONE PAGINA ---
 st.set_page_config(page_title="YANGKIDD ENTERPRISE", page_icon="💎", layout="wide")
@@ -100,13 +107,13 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- ENGINE AI ---
-MODEL = "mistral-nemo"
+MODEL = llm_backend.DEFAULT_MODEL
+COMPETITOR_TTL = 24 * 3600 # i dati web cambiano: un'analisi per competitor al giorno
 
 def stream_ai(messages):
     try:
-        stream = ollama.chat(model=MODEL, messages=messages, stream=True)
-        for chunk in stream:
-            yield chunk['message']['content']
+        for chunk in llm_backend.stream(MODEL, messages):
+            yield chunk
     except Exception as e:
         yield f"⚠️ Errore AI: {str(e)}"
 
@@ -220,9 +227,14 @@ elif nav == "Competitor Tracker":
             # 1. Cerca dati
             res = web_search(f"{target} instagram followers spotify listeners stats", 5)
             
-            # 2. AI Estrae i dati strutturati
+            # 2. AI Estrae i dati strutturati (stessi risultati web = risposta dalla cache, senza LLM)
             prompt = f"Dai seguenti risultati web su {target}, estrai: 1. Numero Followers (stima), 2. Sentiment (Positivo/Neutro/Negativo). Rispondi SOLO nel formato: 'FOLLOWERS|SENTIMENT'. Dati: {str(res)}"
-            ai_extraction = ollama.chat(model=MODEL, messages=[{"role": "user", "content": prompt}])['message']['content']
+            messages = [{"role": "user", "content": prompt}]
+            if res:
+                version = hashlib.sha256(str(res).encode("utf-8")).hexdigest()
+                ai_extraction = llm_cache.cached_chat(MODEL, messages, version, ttl=COMPETITOR_TTL)
+            else:
+                ai_extraction = llm_backend.chat(MODEL, messages) # ricerca fallita: niente da mettere in cache
             
             try:
                 parts = ai_extraction.split("|")
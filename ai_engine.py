@@ -1,47 +1,126 @@
-import ollama
+import uuid
 import sqlite3
-from database import get_connection
-from campaign_logic import get_campaigns
-
-def load_chat_history():
-    conn = get_connection()
-    rows = conn.execute("SELECT role, content FROM chat_history WHERE session_id='MAIN' ORDER BY id ASC").fetchall()
-    conn.close()
-    return [{"role": r[0], "content": r[1]} for r in rows]
-
-def save_chat_message(role, content):
-    conn = get_connection()
-    conn.execute("INSERT INTO chat_history (session_id, role, content) VALUES (?,?,?)", ('MAIN', role, content))
-    conn.commit(); conn.close()
-
-def clear_chat_history():
-    conn = get_connection()
-    conn.execute("DELETE FROM chat_history WHERE session_id='MAIN'"); conn.commit(); conn.close()
-
-def ai_thread(msgs, sp_ctx, kb_ctx, soc_hist, resp):
-    c=get_campaigns(); sp=c['spend'].sum() if not c.empty else 0; rv=c['revenue'].sum() if not c.empty else 0
-    
-    sys = f"""SEI UN MANAGER DI ETICHETTA DISCOGRAFICA (Data-Driven).
-    
-    1. TUA CONOSCENZA (Libri/PDF):
-    {kb_ctx}
-    
-    2. DATI PIATTAFORME:
-    - Spotify: {sp_ctx}
-    - Ads Spend: €{sp}, Revenue: €{rv}
-    
-    3. TREND SOCIAL (Ultimi dati caricati):
-    {soc_hist}
-    
-    OBIETTIVO:
-    Analizza se la crescita social (punto 3) giustifica la spesa ads (punto 2).
-    Sii critico e usa i dati.
+from datetime import datetime
+from database import db_session, data_fingerprint, kb_fingerprint
+from prompt_logic import role_block, ads_block, spotify_block, text_block, build_messages, MODEL_CONTEXT, DEFAULT_CONTEXT
+from generation_logic import get_service
+from memory_logic import chat_memory, clear_memory, schedule_fold
+import llm_cache_logic as llm_cache
+import llm_backend
+
+DEFAULT_MODEL = llm_backend.DEFAULT_MODEL
+CHAT_SESSION = 'MAIN'
+
+PAGE_SIZE = 30   # messaggi caricati per pagina nella UI
+
+# --- SESSIONI ---
+def create_session(title=None):
+    sid = uuid.uuid4().hex[:12]
+    with db_session() as conn:
+        conn.execute("INSERT INTO chat_sessions (id, title) VALUES (?,?)", (sid, title or f"Chat {datetime.now():%d/%m %H:%M}"))
+    return sid
+
+def list_sessions(archived=False):
+    """(id, titolo, ultimo aggiornamento, archiviata), dalla più recente."""
+    with db_session() as conn:
+        return conn.execute("SELECT id, title, updated_at, archived FROM chat_sessions WHERE archived=? ORDER BY updated_at DESC, id",
+                            (1 if archived else 0,)).fetchall()
+
+def archive_session(session_id, archived=True):
+    with db_session() as conn: conn.execute("UPDATE chat_sessions SET archived=? WHERE id=?", (1 if archived else 0, session_id))
+
+def rename_session(session_id, title):
+    with db_session() as conn: conn.execute("UPDATE chat_sessions SET title=? WHERE id=?", (title, session_id))
+
+# --- MESSAGGI ---
+def load_chat_history(session_id=CHAT_SESSION, before_id=None, limit=PAGE_SIZE):
+    """
+    Una pagina di messaggi in ordine cronologico: gli ultimi `limit`, o quelli prima di `before_id`
+    ("carica precedenti"). Usa l'indice (session_id, id). Ogni messaggio ha anche la chiave 'id'.
     """
-    
+    with db_session() as conn:
+        rows = conn.execute("SELECT id, role, content FROM chat_history WHERE session_id=? AND id<? ORDER BY id DESC LIMIT ?",
+                            (session_id, before_id if before_id is not None else 2**62, limit)).fetchall()
+    return [{"id": r[0], "role": r[1], "content": r[2]} for r in reversed(rows)]
+
+def has_older(session_id, before_id):
+    with db_session() as conn:
+        return conn.execute("SELECT 1 FROM chat_history WHERE session_id=? AND id<? LIMIT 1", (session_id, before_id)).fetchone() is not None
+
+def save_chat_message(role, content, session_id=CHAT_SESSION):
+    with db_session() as conn:
+        mid = conn.execute("INSERT INTO chat_history (session_id, role, content) VALUES (?,?,?)", (session_id, role, content)).lastrowid
+        conn.execute("""INSERT INTO chat_sessions (id, title) VALUES (?,?)
+                        ON CONFLICT(id) DO UPDATE SET updated_at=CURRENT_TIMESTAMP""", (session_id, session_id))
+    return mid
+
+def clear_chat_history(session_id=CHAT_SESSION):
+    with db_session() as conn:
+        conn.execute("DELETE FROM chat_history WHERE session_id=?", (session_id,))
+        clear_memory(conn, session_id)
+
+def _prepare(session_id, sp_ctx, kb_ctx, soc_hist, model):
+    # Blocchi versionati: ads/Spotify si ricalcolano solo quando cambiano i dati (o scade il TTL)
+    sp = spotify_block(sp_ctx) if callable(sp_ctx) else text_block("spotify", sp_ctx, "DATI SPOTIFY")
+    blocks = [role_block(), ads_block(), sp, text_block("social", soc_hist, "TREND SOCIAL (Ultimi dati caricati)"),
+              text_block("kb", kb_ctx, "TUA CONOSCENZA (Libri/PDF) pertinente alla domanda")]
+    # Storia limitata, letta dal DB: riassunto rolling fino a un id + i messaggi successivi parola per parola
+    summary, recent = chat_memory(session_id)
+    blocks.append(text_block("memoria", summary, "MEMORIA DELLA CONVERSAZIONE (turni precedenti)"))
+    messages, _ = build_messages(recent, blocks, model)
+    return messages, {'num_ctx': MODEL_CONTEXT.get(model, DEFAULT_CONTEXT)}
+
+def data_version():
+    # Versione della cache LLM: cambia con i dati social/campagne o con la knowledge base
+    return f"{data_fingerprint()}|{kb_fingerprint()}"
+
+def _save_reply(job):
+    # Callback del servizio: salva solo le risposte complete (un prompt annullato non lascia mezze risposte),
+    # poi accoda il riassunto dei turni usciti dalla finestra (priorità bassa, stessa coda)
+    if job.outcome == "done":
+        save_chat_message('assistant', job.text, job.session_id)
+        schedule_fold(job.session_id)
+
+def start_chat(session_id, sp_ctx, kb_ctx, soc_hist, model=DEFAULT_MODEL, use_cache=False):
+    """
+    Accoda la generazione per la sessione chat (una sola in corso per sessione) e ritorna
+    l'id del job da interrogare con poll_chat(). La storia si legge dal DB: il messaggio
+    dell'utente va salvato prima (save_chat_message).
+    use_cache: stessa domanda con stesso contesto e dati invariati = risposta dalla cache LLM.
+    """
+    messages, options = _prepare(session_id, sp_ctx, kb_ctx, soc_hist, model)
+    on_done, cached = _save_reply, None
+    if use_cache:
+        version = data_version()
+        cached = llm_cache.lookup(model, messages, version, options)
+        def on_done(job):
+            if job.outcome == "done" and cached is None: llm_cache.store(model, messages, job.text, version, options)
+            _save_reply(job)
+    return get_service().submit(session_id, messages, model, options, on_done=on_done, cached=cached).id
+
+def poll_chat(job_id, offset=0):
+    return get_service().poll(job_id, offset)
+
+def active_chat(session_id):
+    # Job ancora in corso per la sessione (es. dopo un cambio sessione nella UI)
+    job = get_service().active_job(session_id)
+    return job.id if job else None
+
+def cancel_chat(job_id):
+    return get_service().cancel(job_id)
+
+def ai_thread(msgs, sp_ctx, kb_ctx, soc_hist, resp, model=DEFAULT_MODEL, session_id=CHAT_SESSION, use_cache=False):
+    # Compatibilità con le app che leggono resp['content'] / resp['done'] da un thread dedicato.
+    # msgs resta nella firma ma la storia si legge dal DB della sessione (come in start_chat)
+    messages, options = _prepare(session_id, sp_ctx, kb_ctx, soc_hist, model)
+    version = data_version() if use_cache else ""
     try:
-        # Usa un modello veloce se mistral-nemo è pesante, altrimenti lascia mistral-nemo
-        for ch in ollama.chat(model="mistral-nemo", messages=[{'role':'system','content':sys}]+msgs, stream=True):
-            resp['content']+=ch['message']['content']
-        save_chat_message('assistant', resp['content'])
+        cached = llm_cache.lookup(model, messages, version, options) if use_cache else None
+        if cached is not None: resp['content'] += cached
+        else:
+            for text in llm_backend.stream(model, messages, options): resp['content']+=text
+            if use_cache: llm_cache.store(model, messages, resp['content'], version, options)
+        save_chat_message('assistant', resp['content'], session_id)
+        schedule_fold(session_id)
         resp['done']=True
-    except Exception as e: resp['content']+=f"Errore AI: {str(e)}"; resp['done']=True
\ No newline at end of file
+    except Exception as e: resp['content']+=f"Errore AI: {str(e)}"; resp['done']=True
@@ -0,0 +1,127 @@
+import os
+import threading
+import pandas as pd
+from database import DB_NAME, db_session
+
+try:
+    import duckdb
+except ImportError:  # opzionale: senza DuckDB le query analitiche girano su SQLite
+    duckdb = None
+
+# --- 1. CONFIGURAZIONE ---
+# auto = DuckDB se installato e se il file si lascia collegare, altrimenti SQLite; 'sqlite'/'duckdb' per forzare
+# L'estensione sqlite di DuckDB si scarica una volta sola con install_extension() (avvio app / benchmark):
+# sul percorso delle richieste si fa solo LOAD, che non va in rete
+BACKEND = os.environ.get("ENTERPRISE_ANALYTICS", "auto")
+_duck, _duck_failed = {}, set()
+_duck_lock = threading.Lock()  # una connessione DuckDB condivisa per file: le query passano una alla volta
+_installed = None
+
+# SQL comune ai due motori: placeholder '?', niente json_each, CAST espliciti
+# (DuckDB legge il file SQLite con sqlite_all_varchar, come SQLite confronta le date da stringa)
+CAMPAIGN_IMPACT_SQL = """
+    SELECT m.name AS metric_type, SUM(CAST(f.value AS DOUBLE)) AS total_val
+    FROM stats_facts f
+    JOIN metrics m ON m.id = f.metric_id
+    JOIN platforms p ON p.id = f.platform_id
+    WHERE p.name = ? AND f.date_recorded BETWEEN ? AND ?
+    GROUP BY m.name ORDER BY m.name
+"""
+CAMPAIGN_ADS_SQL = """
+    SELECT m.base AS metric_type, SUM(CAST(f.value AS DOUBLE)) AS total_val
+    FROM metrics m JOIN stats_facts f ON f.metric_id = m.id
+    WHERE m.campaign = ?
+    GROUP BY m.base ORDER BY m.base
+"""
+# dimension/label dal nome della metrica: 'Audience Gender Female (25-34)' -> 'Gender', 'Female (25-34)'
+AUDIENCE_LATEST_SQL = """
+    SELECT p.name AS platform, m.base AS dimension,
+           CASE WHEN m.base = 'Other' THEN SUBSTR(m.name, 10) ELSE SUBSTR(m.name, LENGTH(m.base) + 11) END AS label,
+           CAST(a.value AS DOUBLE) AS value, a.date_recorded
+    FROM audience_stats a
+    JOIN platforms p ON p.id = a.platform_id
+    JOIN metrics m ON m.id = a.metric_id
+    WHERE p.name IN ({ph}) AND a.date_recorded = (SELECT MAX(a2.date_recorded) FROM audience_stats a2
+                                                 JOIN platforms p2 ON p2.id = a2.platform_id WHERE p2.name IN ({ph}))
+    ORDER BY platform, dimension, label
+"""
+# Pivot età x genere: ultima fotografia di ogni piattaforma, attributi da 'metrics'
+AUDIENCE_PIVOT_SQL = """
+    SELECT m.age_band, m.gender, SUM(CAST(f.value AS DOUBLE)) AS value
+    FROM stats_facts f
+    JOIN metrics m ON m.id = f.metric_id
+    JOIN platforms p ON p.id = f.platform_id
+    JOIN (SELECT f2.platform_id, MAX(f2.date_recorded) AS d FROM stats_facts f2 JOIN metrics m2 ON m2.id = f2.metric_id
+          WHERE m2.kind = 'audience' AND m2.base = 'Gender' GROUP BY f2.platform_id) last
+      ON last.platform_id = f.platform_id AND last.d = f.date_recorded
+    WHERE m.kind = 'audience' AND m.base = 'Gender' AND p.name IN ({ph})
+    GROUP BY m.age_band, m.gender
+"""
+
+def placeholders(n):
+    return ", ".join("?" * n)
+
+# --- 2. MOTORE ---
+def install_extension():
+    """Scarica l'estensione sqlite di DuckDB (rete, una volta per processo); False se offline o senza DuckDB."""
+    global _installed
+    if BACKEND == "sqlite" or duckdb is None: return False
+    if _installed is None:
+        try:
+            duckdb.execute("INSTALL sqlite")  # no-op se già nella cartella estensioni
+            _installed = True
+        except Exception:
+            _installed = False
+    return _installed
+
+def _duck_connection(db_path):
+    # Chiamare con _duck_lock acquisito
+    con = _duck.get(db_path)
+    if con is None:
+        con = duckdb.connect()
+        con.execute("LOAD sqlite")  # fallisce se l'estensione non è installata: si resta su SQLite
+        con.execute("SET sqlite_all_varchar = true")
+        path = db_path.replace("'", "''")
+        con.execute(f"ATTACH '{path}' AS src (TYPE sqlite, READ_ONLY)")
+        con.execute("USE src")
+        _duck[db_path] = con
+    return con
+
+def backend(db_path=DB_NAME):
+    """'duckdb' o 'sqlite'. Un ATTACH fallito (estensione sqlite mancante, file assente) non si ritenta."""
+    if BACKEND == "sqlite" or duckdb is None or db_path in _duck_failed: return "sqlite"
+    try:
+        with _duck_lock: _duck_connection(db_path)
+        return "duckdb"
+    except Exception:
+        _duck_failed.add(db_path)
+        return "sqlite"
+
+def run_query(sql, params=(), db_path=DB_NAME, engine=None):
+    """Esegue una query analitica sul motore scelto e ritorna un DataFrame."""
+    if (engine or backend(db_path)) == "duckdb":
+        with _duck_lock: return _duck_connection(db_path).execute(sql, list(params)).df()
+    with db_session(db_path) as conn:
+        return pd.read_sql_query(sql, conn, params=list(params))
+
+# --- 3. QUERY DASHBOARD / CAMPAGNE ---
+def campaign_impact(platform, start_date, end_date, engine=None):
+    return run_query(CAMPAIGN_IMPACT_SQL, (platform, start_date, end_date), engine=engine)
+
+def campaign_ads(campaign, engine=None):
+    return run_query(CAMPAIGN_ADS_SQL, (campaign,), engine=engine)
+
+def audience_latest(platforms, engine=None):
+    platforms = list(platforms)
+    if not platforms: return pd.DataFrame()
+    ph = placeholders(len(platforms))
+    return run_query(AUDIENCE_LATEST_SQL.format(ph=ph), platforms * 2, engine=engine)
+
+def audience_pivot(platforms, engine=None):
+    """Tabella età (righe) x genere (colonne) sommata sulle piattaforme scelte."""
+    platforms = list(platforms)
+    if not platforms: return pd.DataFrame()
+    df = run_query(AUDIENCE_PIVOT_SQL.format(ph=placeholders(len(platforms))), platforms, engine=engine)
+    if df.empty: return df
+    df['age_band'] = df['age_band'].fillna("Totale")
+    return df.pivot_table(index='age_band', columns='gender', values='value', aggfunc='sum').fillna(0)
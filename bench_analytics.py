@@ -0,0 +1,86 @@
+"""
+Benchmark motore analitico: stesse query su SQLite e su DuckDB (file SQLite collegato in sola lettura).
+Uso: python bench_analytics.py [--rows 1000000] [--repeat 5] [--db percorso.db]
+Senza --db genera un database sintetico in una cartella temporanea.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+import analytics_logic
+from database import DB_NAME, db_session, init_advanced_db
+from dimension_logic import ensure_dimensions
+from rollup_logic import rebuild_rollups
+
+PLATFORMS = ["Instagram", "TikTok", "Facebook", "YouTube"]
+SERIES = ["Follower", "Reach", "Impressions", "Views", "Profile Visits"]
+AGES = ["13-17", "18-24", "25-34", "35-44", "45-54", "55+"]
+
+def build_synthetic(rows):
+    # Serie giornaliere + fotografie demografiche settimanali, scritte direttamente nei fatti
+    metrics = SERIES + [f"Audience Gender {g} ({a})" for g in ["Male", "Female"] for a in AGES]
+    per_day = len(PLATFORMS) * (len(SERIES) + (len(metrics) - len(SERIES)) / 7)
+    days = max(1, int(rows / per_day))
+    start = date.today() - timedelta(days=days)
+    with db_session() as conn:
+        ensure_dimensions(conn, [(p, m) for p in PLATFORMS for m in metrics])
+        pid = dict(conn.execute("SELECT name, id FROM platforms"))
+        mid = dict(conn.execute("SELECT name, id FROM metrics"))
+        batch = []
+        for d in range(days):
+            day = (start + timedelta(days=d)).isoformat()
+            for p in PLATFORMS:
+                for m in metrics:
+                    if m.startswith("Audience") and d % 7: continue
+                    batch.append((pid[p], mid[m], day, random.random() * 1000, "bench"))
+            if len(batch) > 100000:
+                conn.executemany("INSERT INTO stats_facts (platform_id, metric_id, date_recorded, value, source_type) VALUES (?,?,?,?,?)", batch); batch = []
+        conn.executemany("INSERT INTO stats_facts (platform_id, metric_id, date_recorded, value, source_type) VALUES (?,?,?,?,?)", batch)
+        rebuild_rollups(conn) # popola audience_stats come farebbe l'ingest
+        n = conn.execute("SELECT COUNT(*) FROM stats_facts").fetchone()[0]
+    return n, start.isoformat(), date.today().isoformat()
+
+def timed(fn, repeat):
+    out = []
+    for _ in range(repeat):
+        t = time.perf_counter(); fn(); out.append(time.perf_counter() - t)
+    return statistics.median(out)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1000000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--db", default=None)
+    a = ap.parse_args()
+
+    if a.db:
+        os.chdir(os.path.dirname(os.path.abspath(a.db)) or ".")
+        if os.path.basename(a.db) != DB_NAME: raise SystemExit(f"Il file deve chiamarsi {DB_NAME}")
+        init_advanced_db()
+        with db_session() as conn:
+            n, d0, d1 = conn.execute("SELECT COUNT(*), MIN(date_recorded), MAX(date_recorded) FROM stats_facts").fetchone()
+    else:
+        os.chdir(tempfile.mkdtemp(prefix="bench_analytics_"))
+        init_advanced_db()
+        n, d0, d1 = build_synthetic(a.rows)
+    print(f"Righe: {n}  periodo {d0} -> {d1}  db: {os.path.abspath(DB_NAME)}")
+
+    queries = {
+        "campaign_impact": lambda e: analytics_logic.campaign_impact(PLATFORMS[0], d0, d1, engine=e),
+        "audience_pivot": lambda e: analytics_logic.audience_pivot(PLATFORMS, engine=e),
+        "audience_latest": lambda e: analytics_logic.audience_latest(PLATFORMS, engine=e),
+    }
+    analytics_logic.install_extension()  # download dell'estensione fuori dalle misure
+    engines = ["sqlite"] + (["duckdb"] if analytics_logic.backend() == "duckdb" else [])
+    if len(engines) == 1: print("DuckDB non disponibile (modulo o estensione sqlite mancante): solo SQLite.")
+
+    print(f"{'query':<18}" + "".join(f"{e:>12}" for e in engines))
+    for name, fn in queries.items():
+        print(f"{name:<18}" + "".join(f"{timed(lambda: fn(e), a.repeat) * 1000:>10.1f}ms" for e in engines))
+
+if __name__ == "__main__":
+    main()
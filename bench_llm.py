@@ -0,0 +1,56 @@
+"""
+Benchmark pipeline chat: prompt costruiti come in ai_engine, generati dal servizio asincrono.
+Uso: python bench_llm.py [--backend fake|ollama] [--models mistral-nemo,llama3] [--requests 20]
+                         [--workers 1] [--tps 25] [--ttft 0.3] [--replay registrazioni.jsonl]
+Con il backend fake non serve Ollama: utile per misurare coda, cancellazioni e overhead della pipeline.
+"""
+import argparse
+import random
+import time
+
+import llm_backend
+from generation_logic import GenerationService
+from prompt_logic import role_block, text_block, build_messages
+
+QUESTIONS = ["La crescita su TikTok giustifica la spesa ads?", "Quale piattaforma ha il miglior engagement?",
+             "Cosa pubblico questa settimana?", "Il budget Meta va aumentato?", "Come va il pubblico 18-24?"]
+
+def synthetic_prompt(i, model):
+    # Contesto di dimensioni realistiche senza database
+    rnd = random.Random(i)
+    social = "\n".join(f"- {p} Follower: {rnd.randint(1000, 90000)} ({rnd.uniform(-5, 15):+.1f}%)" for p in ["Instagram", "TikTok", "YouTube"] * 6)
+    kb = " ".join(rnd.choice(llm_backend.FAKE_WORDS) for _ in range(900))
+    blocks = [role_block(), text_block("social", social, "TREND SOCIAL"), text_block("kb", kb, "TUA CONOSCENZA")]
+    msgs, _ = build_messages([{"role": "user", "content": QUESTIONS[i % len(QUESTIONS)]}], blocks, model)
+    return msgs
+
+def fmt(x, unit=""):
+    return f"{x:.2f}{unit}" if isinstance(x, (int, float)) else "-"
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backend", default="fake", choices=sorted(llm_backend.BACKENDS))
+    ap.add_argument("--models", default=llm_backend.DEFAULT_MODEL)
+    ap.add_argument("--requests", type=int, default=20)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--tps", type=float, default=llm_backend.FAKE_TPS)
+    ap.add_argument("--ttft", type=float, default=llm_backend.FAKE_TTFT)
+    ap.add_argument("--replay", default=llm_backend.REPLAY_PATH)
+    a = ap.parse_args()
+
+    backend = llm_backend.FakeBackend(tps=a.tps, ttft=a.ttft, replay_path=a.replay) if a.backend == "fake" else llm_backend.OllamaBackend()
+    for model in a.models.split(","):
+        svc = GenerationService(backend=backend, workers=a.workers, queue_max=max(a.requests, 1))
+        t = time.perf_counter()
+        jobs = [svc.submit(f"bench-{i}", synthetic_prompt(i, model), model) for i in range(a.requests)]
+        while any(j.status in ("queued", "running") for j in jobs): time.sleep(0.01)
+        wall = time.perf_counter() - t
+        queued = sorted((j.started or j.finished) - j.created for j in jobs if j.finished)
+        for s in llm_backend.metrics_summary(model):
+            print(f"[{s['backend']}] {model}: {s['requests']} richieste ({s['errors']} errori) in {wall:.1f}s | "
+                  f"TTFT p50 {fmt(s['ttft_p50'], 's')} p95 {fmt(s['ttft_p95'], 's')} | {fmt(s['tokens_per_s'])} token/s | "
+                  f"prompt ~{s['prompt_tokens']:.0f} token | attesa in coda max {fmt(queued[-1] if queued else None, 's')}")
+        llm_backend.clear_metrics()
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,163 @@
 import sqlite3
+import threading
+import functools
 import pandas as pd
+from collections import OrderedDict
+from contextlib import contextmanager
 
 DB_NAME = "enterprise_os.db"
 
-def get_connection():
-    return sqlite3.connect(DB_NAME, check_same_thread=False)
+# --- CONNECTION MANAGER ---
+# Una connessione per thread (e per file DB), riusata tra le chiamate.
+# WAL permette al thread AI di scrivere mentre la UI legge.
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",  # 256 MB
+    "PRAGMA cache_size=-65536",    # 64 MB
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=OFF",
+]
+_local = threading.local()
 
-def init_advanced_db():
-    conn = get_connection()
+def get_connection(db_path=DB_NAME):
+    """Connessione condivisa del thread corrente. NON chiuderla: usa db_session()."""
+    conns = getattr(_local, 'conns', None)
+    if conns is None: conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        for p in PRAGMAS: conn.execute(p)
+        conns[db_path] = conn
+    return conn
+
+@contextmanager
+def db_session(db_path=DB_NAME):
+    """
+    Context manager sulla connessione del thread: commit all'uscita, rollback su errore.
+    Le sessioni annidate condividono la transazione della più esterna.
+    """
+    conn = get_connection(db_path)
+    depth = getattr(_local, 'depth', None)
+    if depth is None: depth = _local.depth = {}
+    depth[db_path] = depth.get(db_path, 0) + 1
+    try:
+        yield conn
+        if depth[db_path] == 1:
+            conn.commit()
+            pending, _local.bump_pending = getattr(_local, 'bump_pending', set()), set()
+            for domain in pending: _bump_now(domain)
+    except:
+        if depth[db_path] == 1: conn.rollback(); _local.bump_pending = set()
+        raise
+    finally:
+        depth[db_path] -= 1
+
+def close_connections():
+    # Chiude le connessioni del thread corrente (fine job in background)
+    for conn in getattr(_local, 'conns', {}).values(): conn.close()
+    _local.conns = {}
+
+# --- GENERAZIONE DATI & CACHE LETTURE ---
+# Contatori in memoria per dominio, incrementati dalle scritture: finché non cambiano
+# i rerun di Streamlit rileggono dalla cache senza fare SQL.
+# 'stats' = dati social, campagne e snapshot (dashboard); 'kb' = knowledge base (PDF, pagine web).
+# Un ingest di PDF non svuota le cache della dashboard.
+_generation = {"stats": 0, "kb": 0}
+_gen_lock = threading.Lock()
+
+def data_generation(domain="stats"):
+    return _generation[domain]
+
+def bump_generation(domain="stats"):
+    # Dentro una transazione aperta: si incrementa solo dopo il commit della sessione esterna
+    if any(getattr(_local, 'depth', {}).values()):
+        pending = getattr(_local, 'bump_pending', None)
+        if pending is None: pending = _local.bump_pending = set()
+        pending.add(domain); return
+    _bump_now(domain)
+
+def _bump_now(domain):
+    with _gen_lock: _generation[domain] += 1
+
+def _copy_result(res):
+    # I chiamanti modificano i DataFrame: la cache restituisce sempre copie
+    if isinstance(res, pd.DataFrame): return res.copy()
+    if isinstance(res, tuple): return tuple(_copy_result(x) for x in res)
+    return res
+
+def cached_read(maxsize=16, fallback=None, domain="stats"):
+    """
+    Memoizza una lettura per (generazione del dominio, argomenti); LRU con al massimo maxsize voci.
+    Solo i risultati riusciti vanno in cache: se la lettura solleva (es. "database is locked")
+    si restituisce fallback() senza memorizzarlo, e al rerun successivo si riprova.
+    Senza fallback l'eccezione arriva al chiamante.
+    """
+    def deco(fn):
+        cache, lock = OrderedDict(), threading.Lock()
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            gen = _generation[domain]
+            key = (args, tuple(sorted(kwargs.items())))
+            with lock:
+                hit = cache.get(key)
+                if hit and hit[0] == gen:
+                    cache.move_to_end(key)
+                    return _copy_result(hit[1])
+            try: res = fn(*args, **kwargs)
+            except Exception:
+                if fallback is None: raise
+                return fallback()
+            with lock:
+                cache[key] = (gen, res)
+                cache.move_to_end(key)
+                while len(cache) > maxsize: cache.popitem(last=False)
+            return _copy_result(res)
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return deco
+
+@cached_read(maxsize=1)
+def data_fingerprint():
+    """
+    Versione persistente dei dati social e campagne (sopravvive ai riavvii, a differenza di data_generation):
+    dimensione/ultimo id/somma dei fatti social (il merge aggiorna i valori sul posto), totali campagne.
+    Non conta la KB: un ingest di PDF non rende vecchio lo snapshot Parquet.
+    """
+    with db_session() as conn:
+        row = conn.execute("""SELECT (SELECT COUNT(*) || ':' || IFNULL(MAX(id), 0) || ':' || TOTAL(value) FROM stats_facts),
+                                     (SELECT COUNT(*) || ':' || TOTAL(spend) || ':' || TOTAL(revenue) FROM campaigns)""").fetchone()
+    return "|".join(str(x) for x in row)
+
+@cached_read(maxsize=1, domain="kb")
+def kb_fingerprint():
+    # Versione persistente della knowledge base: numero e ultimo id dei passaggi
+    with db_session() as conn:
+        row = conn.execute("SELECT COUNT(*), IFNULL(MAX(id), 0) FROM knowledge_chunks").fetchone()
+    return ":".join(str(x) for x in row)
+
+# Riassunti della memoria chat (M10); anche le app con un DB proprio la creano così (memory_logic.init_memory)
+CHAT_SUMMARIES_SQL = '''CREATE TABLE IF NOT EXISTS chat_summaries (
+                            session_id TEXT,
+                            upto_id INTEGER,
+                            content TEXT,
+                            tokens INTEGER,
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            PRIMARY KEY (session_id, upto_id)
+                        ) WITHOUT ROWID'''
+
+_schema_ready = set()
+
+def init_advanced_db(force=False):
+    # Lo schema si verifica una volta per processo, non a ogni rerun
+    if DB_NAME in _schema_ready and not force: return
+    with db_session() as conn:
+        normalized = _create_schema(conn)
+    # M6 ha riscritto social_stats in stats_facts: VACUUM (fuori dalla transazione) restituisce lo spazio al disco
+    if normalized: get_connection().execute("VACUUM")
+    _schema_ready.add(DB_NAME)
+
+def _create_schema(conn):
     c = conn.cursor()
     
     # 1. TABELLA STATISTICHE GENERALI (Esistente)
@@ -84,6 +234,197 @@ def init_advanced_db():
                     content TEXT,
                     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )''')
-    
-    conn.commit()
-    conn.close()
\ No newline at end of file
+
+    # --- MIGRAZIONI ---
+
+    # M1. CHIAVE UNICA SOCIAL_STATS (UPSERT nativo al posto di DELETE+INSERT)
+    # (dopo M6 social_stats è una vista: la chiave unica vive su stats_facts)
+    if _is_table(c, 'social_stats') and not c.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_social_stats_key'").fetchone():
+        # Tiene la riga scritta per ultima, come faceva il vecchio upsert
+        c.execute('''DELETE FROM social_stats WHERE id NOT IN (
+                        SELECT MAX(id) FROM social_stats GROUP BY platform, metric_type, date_recorded
+                    )''')
+        c.execute("CREATE UNIQUE INDEX idx_social_stats_key ON social_stats(platform, metric_type, date_recorded)")
+
+    # M2. FINGERPRINT UPLOAD (dedup per contenuto, non per nome file)
+    _add_columns(c, "upload_logs", {"file_hash": "TEXT", "row_count": "INTEGER", "date_min": "DATE", "date_max": "DATE"})
+    c.execute("CREATE INDEX IF NOT EXISTS idx_upload_logs_hash ON upload_logs(file_hash, platform)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_upload_logs_range ON upload_logs(platform, date_max)")
+
+    # M3. ULTIMO SNAPSHOT PER POST (niente subquery correlata nel tab Content)
+    if not c.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_posts_perf_key'").fetchone():
+        c.execute('''DELETE FROM posts_performance WHERE id NOT IN (
+                        SELECT MAX(id) FROM posts_performance GROUP BY post_id, date_recorded
+                    )''')
+        c.execute("CREATE UNIQUE INDEX idx_posts_perf_key ON posts_performance(post_id, date_recorded)")
+    if not c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='posts_latest'").fetchone():
+        c.execute('''CREATE TABLE posts_latest (
+                        post_id TEXT PRIMARY KEY,
+                        date_recorded DATE,
+                        views INTEGER,
+                        likes INTEGER,
+                        comments INTEGER,
+                        shares INTEGER
+                    )''')
+        c.execute('''INSERT INTO posts_latest (post_id, date_recorded, views, likes, comments, shares)
+                     SELECT post_id, date_recorded, views, likes, comments, shares FROM (
+                        SELECT *, ROW_NUMBER() OVER (PARTITION BY post_id ORDER BY date_recorded DESC) AS rn
+                        FROM posts_performance WHERE date_recorded IS NOT NULL
+                     ) WHERE rn = 1''')
+
+    # M4. ROLLUP GIORNO/SETTIMANA/MESE + TABELLA DEMOGRAFICA (aggiornate in ingest, vedi rollup_logic)
+    # Hanno le chiavi intere dei fatti: si creano (o si ricreano, se ancora per nome) e si ricostruiscono in M6
+
+    # M6. DIMENSIONI NORMALIZZATE: platforms + metrics (attributi strutturati) e fatti con chiavi intere.
+    # social_stats diventa una vista con le stesse colonne, quindi le letture esistenti non cambiano.
+    normalized = _is_table(c, 'social_stats')
+    if normalized:
+        c.execute('''CREATE TABLE IF NOT EXISTS platforms (
+                        id INTEGER PRIMARY KEY,
+                        name TEXT UNIQUE
+                    )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS metrics (
+                        id INTEGER PRIMARY KEY,
+                        name TEXT UNIQUE,
+                        kind TEXT,
+                        base TEXT,
+                        gender TEXT,
+                        age_band TEXT,
+                        geo TEXT,
+                        campaign TEXT
+                    )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS stats_facts (
+                        id INTEGER PRIMARY KEY,
+                        platform_id INTEGER,
+                        metric_id INTEGER,
+                        date_recorded DATE,
+                        value REAL,
+                        source_type TEXT,
+                        UNIQUE (platform_id, metric_id, date_recorded)
+                    )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_metrics_kind ON metrics(kind, base, gender, age_band)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_metrics_campaign ON metrics(campaign) WHERE campaign IS NOT NULL")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_stats_facts_metric ON stats_facts(metric_id, date_recorded)")
+        # Filtro per periodo e paginazione del tab Dati (ORDER BY date_recorded DESC senza sort in memoria)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_stats_facts_date ON stats_facts(date_recorded, platform_id)")
+
+        from dimension_logic import ensure_dimensions
+        ensure_dimensions(conn, c.execute("SELECT DISTINCT platform, metric_type FROM social_stats WHERE platform IS NOT NULL AND metric_type IS NOT NULL").fetchall())
+        c.execute('''INSERT OR IGNORE INTO stats_facts (id, platform_id, metric_id, date_recorded, value, source_type)
+                     SELECT s.id, p.id, m.id, s.date_recorded, s.value, s.source_type
+                     FROM social_stats s JOIN platforms p ON p.name = s.platform JOIN metrics m ON m.name = s.metric_type''')
+        c.execute("DROP TABLE social_stats")
+        c.execute('''CREATE VIEW social_stats AS
+                     SELECT f.id, p.name AS platform, m.name AS metric_type, f.value, f.date_recorded, f.source_type
+                     FROM stats_facts f JOIN platforms p ON p.id = f.platform_id JOIN metrics m ON m.id = f.metric_id''')
+        # Rollup e demografica (M4) con le stesse chiavi intere: le versioni per nome si ricostruiscono dai fatti
+        c.execute("DROP TABLE IF EXISTS stats_rollup")
+        c.execute("DROP TABLE IF EXISTS audience_stats")
+        c.execute('''CREATE TABLE stats_rollup (
+                        grain TEXT,
+                        platform_id INTEGER,
+                        metric_id INTEGER,
+                        period DATE,
+                        value_sum REAL,
+                        value_avg REAL,
+                        value_last REAL,
+                        n INTEGER,
+                        PRIMARY KEY (grain, platform_id, metric_id, period)
+                    ) WITHOUT ROWID''')
+        c.execute('''CREATE TABLE audience_stats (
+                        platform_id INTEGER,
+                        metric_id INTEGER,
+                        date_recorded DATE,
+                        value REAL,
+                        PRIMARY KEY (platform_id, metric_id, date_recorded)
+                    ) WITHOUT ROWID''')
+        c.execute("CREATE INDEX idx_audience_date ON audience_stats(date_recorded, platform_id)")
+        from rollup_logic import rebuild_rollups
+        rebuild_rollups(conn)
+
+    # M7. PASSAGGI KNOWLEDGE + INDICE FTS5/BM25 (il prompt riceve solo i passaggi pertinenti)
+    if not _is_table(c, 'knowledge_chunks'):
+        c.execute('''CREATE TABLE knowledge_chunks (
+                        id INTEGER PRIMARY KEY,
+                        doc_id INTEGER,
+                        seq INTEGER,
+                        content TEXT,
+                        tokens INTEGER,
+                        content_hash TEXT
+                    )''')
+        c.execute("CREATE INDEX idx_knowledge_chunks_doc ON knowledge_chunks(doc_id, seq)")
+        c.execute('''CREATE VIRTUAL TABLE knowledge_fts USING fts5(
+                        content, content='knowledge_chunks', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+                    )''')
+        # Indice esterno sincronizzato dai trigger
+        c.execute('''CREATE TRIGGER knowledge_chunks_ai AFTER INSERT ON knowledge_chunks BEGIN
+                        INSERT INTO knowledge_fts(rowid, content) VALUES (new.id, new.content);
+                    END''')
+        c.execute('''CREATE TRIGGER knowledge_chunks_ad AFTER DELETE ON knowledge_chunks BEGIN
+                        INSERT INTO knowledge_fts(knowledge_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                    END''')
+        from retrieval_logic import reindex_missing
+        reindex_missing(conn)
+
+    # M8. EMBEDDING DEI PASSAGGI (float32 in BLOB, chiave = hash del testo + modello)
+    _add_columns(c, "knowledge_chunks", {"content_hash": "TEXT"})
+    if not _is_table(c, 'knowledge_embeddings'):
+        c.execute('''CREATE TABLE knowledge_embeddings (
+                        content_hash TEXT,
+                        model TEXT,
+                        dim INTEGER,
+                        vector BLOB,
+                        PRIMARY KEY (content_hash, model)
+                    ) WITHOUT ROWID''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_knowledge_chunks_hash ON knowledge_chunks(content_hash)")
+        from embedding_logic import content_hash
+        rows = c.execute("SELECT id, content FROM knowledge_chunks WHERE content_hash IS NULL").fetchall()
+        c.executemany("UPDATE knowledge_chunks SET content_hash=? WHERE id=?", [(content_hash(t), i) for i, t in rows])
+
+    # M9. INGEST PDF INCREMENTALE (stato per file + pagine estratte, per riprendere dopo un'interruzione)
+    c.execute('''CREATE TABLE IF NOT EXISTS knowledge_files (
+                    path TEXT PRIMARY KEY,
+                    mtime REAL,
+                    size INTEGER,
+                    sha256 TEXT,
+                    status TEXT,
+                    pages_total INTEGER,
+                    pages_done INTEGER,
+                    doc_id INTEGER,
+                    error TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS knowledge_pages (
+                    path TEXT,
+                    page INTEGER,
+                    content TEXT,
+                    PRIMARY KEY (path, page)
+                ) WITHOUT ROWID''')
+
+    # M10. MEMORIA CHAT (riassunto rolling dei turni usciti dalla finestra del prompt)
+    c.execute(CHAT_SUMMARIES_SQL)
+
+    # M11. SESSIONI CHAT (crea / elenca / archivia) + indice per il caricamento a pagine
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_session ON chat_history(session_id, id)")
+    if not _is_table(c, 'chat_sessions'):
+        c.execute('''CREATE TABLE chat_sessions (
+                        id TEXT PRIMARY KEY,
+                        title TEXT,
+                        archived INTEGER DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )''')
+        # Le conversazioni esistenti diventano sessioni ('MAIN' = chat principale)
+        c.execute('''INSERT INTO chat_sessions (id, title, created_at, updated_at)
+                     SELECT session_id, CASE WHEN session_id='MAIN' THEN 'Principale' ELSE session_id END, MIN(timestamp), MAX(timestamp)
+                     FROM chat_history WHERE session_id IS NOT NULL GROUP BY session_id''')
+    return normalized
+
+def _is_table(c, name):
+    return c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+def _add_columns(c, table, cols):
+    # ALTER TABLE idempotente: aggiunge solo le colonne mancanti
+    existing = {r[1] for r in c.execute(f"PRAGMA table_info({table})")}
+    for name, decl in cols.items():
+        if name not in existing: c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
@@ -0,0 +1,44 @@
+import re
+from functools import lru_cache
+
+# --- 1. CONFIGURAZIONE ---
+# Nomi metrica composti da save_social_bulk/build_stat_rows: gli attributi finiscono in colonne di 'metrics'
+AUDIENCE_RE = re.compile(r'^Audience (Gender|Geo) (.+)$')
+AGE_RE = re.compile(r'^(.*?)\s*\(([^()]*)\)$')
+CAMPAIGN_RE = re.compile(r'^(Spend|Impressions) \((.+)\)$')
+METRIC_COLUMNS = ["name", "kind", "base", "gender", "age_band", "geo", "campaign"]
+
+# --- 2. PARSING ---
+@lru_cache(maxsize=4096)
+def parse_metric_name(name):
+    """
+    'Audience Gender Female (25-34)' -> kind='audience', base='Gender', gender='Female', age_band='25-34'
+    'Audience Geo Italia'            -> kind='audience', base='Geo', geo='Italia'
+    'Spend (Campagna X)'             -> kind='campaign', base='Spend', campaign='Campagna X'
+    altro                            -> kind='series', base=name
+    Ritorna una tupla nell'ordine di METRIC_COLUMNS.
+    """
+    gender = age = geo = camp = None
+    m = AUDIENCE_RE.match(name or "")
+    if m:
+        kind, base, label = "audience", m.group(1), m.group(2)
+        if base == "Geo": geo = label
+        else:
+            a = AGE_RE.match(label)
+            gender, age = (a.group(1) or None, a.group(2)) if a else (label, None)
+    elif CAMPAIGN_RE.match(name or ""):
+        m = CAMPAIGN_RE.match(name)
+        kind, base, camp = "campaign", m.group(1), m.group(2)
+    elif name and name.startswith("Audience"):
+        kind, base = "audience", "Other"
+    else:
+        kind, base = "series", name
+    return (name, kind, base, gender, age, geo, camp)
+
+# --- 3. SCRITTURA ---
+def ensure_dimensions(conn, stat_rows):
+    """Registra piattaforme e metriche nuove prima dell'UPSERT sui fatti (dentro la transazione del chiamante)."""
+    if not stat_rows: return
+    conn.executemany("INSERT OR IGNORE INTO platforms (name) VALUES (?)", [(p,) for p in {r[0] for r in stat_rows}])
+    conn.executemany(f"INSERT OR IGNORE INTO metrics ({', '.join(METRIC_COLUMNS)}) VALUES ({', '.join('?' * len(METRIC_COLUMNS))})",
+                     [parse_metric_name(m) for m in {r[1] for r in stat_rows}])
@@ -0,0 +1,121 @@
+import os
+import re
+import hashlib
+import threading
+import numpy as np
+from database import db_session
+
+# --- 1. CONFIGURAZIONE ---
+# ENTERPRISE_EMBEDDER: 'ollama' (default) o 'stub' (deterministico, per test offline)
+EMBEDDER = os.environ.get("ENTERPRISE_EMBEDDER", "ollama")
+EMBED_MODEL = os.environ.get("ENTERPRISE_EMBED_MODEL", "nomic-embed-text")
+EMBED_BATCH = 32
+STUB_DIM = 256
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+def content_hash(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+# --- 2. EMBEDDER ---
+class OllamaEmbedder:
+    """Endpoint embeddings di Ollama (locale)."""
+    def __init__(self, model=EMBED_MODEL, host=None):
+        import ollama
+        self.model = model
+        self.client = ollama.Client(host=host) if host else ollama
+
+    def embed(self, texts):
+        if hasattr(self.client, "embed"):
+            return np.asarray(self.client.embed(model=self.model, input=list(texts))["embeddings"], dtype=np.float32)
+        # Client vecchi: una chiamata per testo
+        return np.asarray([self.client.embeddings(model=self.model, prompt=t)["embedding"] for t in texts], dtype=np.float32)
+
+class StubEmbedder:
+    """Feature hashing delle parole: stessi termini -> vettori vicini. Nessuna rete, risultati stabili."""
+    def __init__(self, dim=STUB_DIM):
+        self.model, self.dim = f"stub-{dim}", dim
+
+    def embed(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            for w in _WORD_RE.findall((t or "").lower()):
+                h = int.from_bytes(hashlib.md5(w.encode("utf-8")).digest()[:4], "little")
+                out[i, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return out
+
+_embedder = None
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        _embedder = StubEmbedder() if EMBEDDER == "stub" else OllamaEmbedder()
+    return _embedder
+
+def set_embedder(embedder):
+    # Test / configurazione esplicita
+    global _embedder
+    _embedder = embedder
+    _matrix_cache.clear()
+
+# --- 3. SCRITTURA (CACHE PER HASH) ---
+def embed_missing(embedder=None, doc_id=None):
+    """
+    Calcola gli embedding dei passaggi che non ne hanno ancora uno per il modello corrente.
+    La chiave è l'hash del testo: reingest e passaggi duplicati non ricalcolano nulla.
+    Le chiamate al modello avvengono fuori da ogni transazione; ogni blocco si scrive in una
+    sessione breve, così il lock di scrittura non resta preso per la durata degli embedding.
+    Da non chiamare dentro un db_session aperto (le sessioni annidate committano con l'esterna).
+    """
+    embedder = embedder or get_embedder()
+    sql = """SELECT DISTINCT c.content_hash, c.content FROM knowledge_chunks c
+             LEFT JOIN knowledge_embeddings e ON e.content_hash = c.content_hash AND e.model = ?
+             WHERE e.content_hash IS NULL"""
+    params = [embedder.model]
+    if doc_id is not None: sql += " AND c.doc_id = ?"; params.append(doc_id)
+    with db_session() as conn: todo = conn.execute(sql, params).fetchall()
+    for i in range(0, len(todo), EMBED_BATCH):
+        batch = todo[i:i + EMBED_BATCH]
+        vecs = embedder.embed([t for _, t in batch])
+        with db_session() as conn:
+            conn.executemany("INSERT OR REPLACE INTO knowledge_embeddings (content_hash, model, dim, vector) VALUES (?,?,?,?)",
+                             [(h, embedder.model, int(v.shape[0]), v.astype(np.float32).tobytes()) for (h, _), v in zip(batch, vecs)])
+    return len(todo)
+
+# --- 4. RICERCA ---
+_matrix_cache = {}
+_matrix_lock = threading.Lock()
+
+def _load_matrix(conn, model):
+    # Matrice (passaggi x dim) normalizzata, ricaricata solo quando cambiano passaggi o embedding
+    version = conn.execute("""SELECT (SELECT COUNT(*) FROM knowledge_chunks), (SELECT MAX(id) FROM knowledge_chunks),
+                                     (SELECT COUNT(*) FROM knowledge_embeddings WHERE model = ?)""", (model,)).fetchone()
+    with _matrix_lock:
+        hit = _matrix_cache.get(model)
+        if hit and hit[0] == version: return hit[1], hit[2]
+    rows = conn.execute("""SELECT c.id, e.vector FROM knowledge_chunks c
+                           JOIN knowledge_embeddings e ON e.content_hash = c.content_hash AND e.model = ?
+                           ORDER BY c.id""", (model,)).fetchall()
+    ids = np.array([r[0] for r in rows], dtype=np.int64)
+    mat = np.vstack([np.frombuffer(r[1], dtype=np.float32) for r in rows]) if rows else np.zeros((0, 1), dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    mat = mat / np.where(norms == 0, 1, norms)
+    with _matrix_lock: _matrix_cache[model] = (version, ids, mat)
+    return ids, mat
+
+def semantic_search(query, k=6, embedder=None):
+    """Top-k passaggi per similarità coseno: lista di (chunk_id, source, content, tokens, score); score = -coseno."""
+    if not (query or "").strip(): return []
+    embedder = embedder or get_embedder()
+    with db_session() as conn:
+        ids, mat = _load_matrix(conn, embedder.model)
+        if len(ids) == 0: return []
+        q = embedder.embed([query])[0]
+        if q.shape[0] != mat.shape[1]: return []
+        q = q / (np.linalg.norm(q) or 1)
+        sims = mat @ q
+        top = np.argpartition(-sims, min(k, len(sims)) - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        meta = {r[0]: r[1:] for r in conn.execute(
+            """SELECT c.id, kb.source, c.content, c.tokens FROM knowledge_chunks c JOIN knowledge_base kb ON kb.id = c.doc_id
+               WHERE c.id IN (SELECT value FROM json_each(?))""", (str([int(i) for i in ids[top]]),))}
+    return [(int(ids[i]), *meta[int(ids[i])], float(-sims[i])) for i in top if int(ids[i]) in meta and sims[i] > 0]
@@ -0,0 +1,154 @@
+import os
+import time
+import asyncio
+import itertools
+import threading
+from llm_backend import get_backend, OllamaBackend
+
+# --- 1. CONFIGURAZIONE ---
+QUEUE_MAX = 8            # richieste in attesa oltre le quali submit() rifiuta
+WORKERS = int(os.environ.get("ENTERPRISE_GEN_WORKERS", "1"))  # generazioni contemporanee (CPU condivisa)
+KEEP_JOBS = 100          # job conclusi tenuti in memoria per il polling
+PRIORITY_CHAT = 0        # risposte in chat: passano prima
+PRIORITY_BACKGROUND = 1  # lavori di servizio (es. riassunto della memoria chat)
+
+FINAL = ("done", "cancelled", "error", "rejected")
+
+class Job:
+    """
+    Una generazione: testo accumulato token per token, letto dalla UI con read(offset).
+    outcome è l'esito della generazione (letto da on_done); status diventa finale solo dopo on_done,
+    così la UI non vede 'done' prima che la risposta sia salvata.
+    """
+    def __init__(self, job_id, session_id, messages, model, options, on_done, priority=PRIORITY_CHAT):
+        self.id, self.session_id, self.priority = job_id, session_id, priority
+        self.messages, self.model, self.options, self.on_done = messages, model, options, on_done
+        self.status, self.outcome, self.error, self.text = "queued", None, None, ""
+        self.created, self.started, self.first_token, self.finished = time.time(), None, None, None
+        self.task = None
+        self._lock = threading.Lock()
+
+    def append(self, s):
+        with self._lock:
+            if self.first_token is None: self.first_token = time.time()
+            self.text += s
+
+    def read(self, offset=0):
+        with self._lock: return self.text[offset:], self.status, self.error
+
+# --- 2. SERVIZIO (EVENT LOOP IN UN THREAD DEDICATO) ---
+class GenerationService:
+    """
+    Coda limitata + worker asyncio: una sola richiesta per sessione (un nuovo prompt annulla
+    quello precedente, in coda o in corso), al massimo WORKERS generazioni insieme.
+    La coda è per priorità: i job in background partono solo quando non ci sono risposte in attesa.
+    """
+    def __init__(self, host=None, workers=WORKERS, queue_max=QUEUE_MAX, backend=None):
+        # host: Ollama su un indirizzo esplicito (es. server finto nei test); altrimenti il backend configurato
+        self.host, self.backend = host, backend
+        self.jobs, self.by_session = {}, {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, args=(workers, queue_max), daemon=True)
+        self.thread.start()
+        self._ready.wait()
+
+    def _run(self, workers, queue_max):
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.PriorityQueue(maxsize=queue_max)
+        for _ in range(workers): self.loop.create_task(self._worker())
+        self._ready.set()
+        self.loop.run_forever()
+
+    def _backend(self):
+        if self.backend is None: self.backend = OllamaBackend(host=self.host) if self.host else get_backend()
+        return self.backend
+
+    # --- API (thread della UI) ---
+    def submit(self, session_id, messages, model, options=None, on_done=None, cached=None, priority=PRIORITY_CHAT):
+        """
+        Accoda una generazione e ritorna il job; status 'rejected' se la coda è piena
+        (in quel caso la generazione già in corso per la sessione continua).
+        Con `cached` (risposta già nota) il job nasce concluso senza passare dalla coda.
+        priority: PRIORITY_CHAT o PRIORITY_BACKGROUND (a parità, ordine di arrivo).
+        """
+        with self._lock:
+            prev = self.by_session.get(session_id)
+            job = Job(next(self._ids), session_id, messages, model, options, on_done, priority)
+            self.jobs[job.id] = job
+            self._prune()
+        if cached is None:
+            # Prima si accoda: il job precedente si annulla solo se il nuovo è stato accettato
+            asyncio.run_coroutine_threadsafe(self._enqueue(job), self.loop).result(timeout=5)
+            if job.status == "rejected": return job
+        with self._lock: self.by_session[session_id] = job.id
+        if prev: self.cancel(prev)
+        if cached is not None:
+            job.append(cached)
+            job.outcome, job.started, job.finished = "done", job.created, time.time()
+            if on_done: on_done(job)
+            job.status = "done"
+        return job
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if not job or job.status in FINAL: return False
+        if job.status == "queued": job.status = "cancelled"; return True  # il worker lo scarta
+        if job.task: self.loop.call_soon_threadsafe(job.task.cancel)
+        return True
+
+    def poll(self, job_id, offset=0):
+        """(testo nuovo da offset, status, errore): lettura in memoria, nessun I/O."""
+        job = self.jobs.get(job_id)
+        return job.read(offset) if job else ("", "unknown", None)
+
+    def active_job(self, session_id):
+        job = self.jobs.get(self.by_session.get(session_id))
+        return job if job and job.status not in FINAL else None
+
+    def _prune(self):
+        done = [j for j in self.jobs.values() if j.status in FINAL]
+        for j in done[:max(0, len(self.jobs) - KEEP_JOBS)]: del self.jobs[j.id]
+
+    # --- EVENT LOOP ---
+    async def _enqueue(self, job):
+        try: self.queue.put_nowait((job.priority, job.id, job))
+        except asyncio.QueueFull: job.status, job.error = "rejected", "Coda piena: riprova tra poco."
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self.queue.get()
+            try:
+                if job.status != "queued": continue  # annullato mentre era in coda
+                job.status, job.started = "running", time.time()
+                job.task = asyncio.ensure_future(self._generate(job))
+                await asyncio.wait([job.task])
+                if job.on_done: await asyncio.to_thread(job.on_done, job)
+                job.status = job.outcome
+            except Exception as e:
+                job.status, job.error = "error", str(e)
+            finally:
+                self.queue.task_done()
+
+    async def _generate(self, job):
+        try:
+            async for text in self._backend().astream(job.model, job.messages, job.options): job.append(text)
+            job.outcome = "done"
+        except asyncio.CancelledError:
+            job.outcome = "cancelled"
+        except Exception as e:
+            job.outcome, job.error = "error", str(e)
+        finally:
+            job.finished = time.time()
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_service():
+    # Un servizio per processo: sopravvive ai rerun di Streamlit
+    global _service
+    with _service_lock:
+        if _service is None: _service = GenerationService()
+        return _service
@@ -0,0 +1,111 @@
+import os
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from database import db_session, bump_generation
+from social_logic import stream_csv_chunks, detect_metric_from_filename, build_stat_rows, write_stat_rows, add_counts, find_overlapping_upload, log_upload_event
+
+# --- 1. WORKER (PROCESSO SEPARATO) ---
+def spool_upload(f):
+    """Copia l'upload su un file temporaneo: ai worker passa il percorso, non i byte."""
+    f.seek(0)
+    with tempfile.NamedTemporaryFile(prefix="upload_", suffix=".csv", delete=False) as tmp:
+        shutil.copyfileobj(f, tmp)
+    return tmp.name
+
+def parse_upload(name, path, platform):
+    """
+    CSV su disco -> righe normalizzate, senza toccare il DB (gira nel process pool).
+    Ogni blocco normalizzato viene accodato a un file temporaneo: il worker tiene in memoria
+    un blocco alla volta e il writer li rilegge uno alla volta.
+    Ritorna (name, percorso dei blocchi, msg); il percorso è None se il file non è leggibile.
+    """
+    metric = detect_metric_from_filename(name)
+    with open(path, "rb") as f:
+        chunks, msg = stream_csv_chunks(f)
+        if chunks is None: return name, None, msg
+        with tempfile.NamedTemporaryFile(prefix="parsed_", suffix=".pkl", delete=False) as out:
+            try:
+                for df in chunks: pickle.dump(build_stat_rows(df, platform, metric), out, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                out.close(); os.remove(out.name); raise
+    return name, out.name, "OK"
+
+def iter_parsed(path):
+    # Rilegge i blocchi scritti da parse_upload, uno alla volta
+    with open(path, "rb") as f:
+        while True:
+            try: yield pickle.load(f)
+            except EOFError: return
+
+# --- 2. WRITER UNICO ---
+def write_parsed(name, platform, parts, file_hash=None):
+    """
+    Scrive un file già normalizzato in una transazione e registra l'upload con il suo fingerprint
+    (hash, righe, intervallo date). Le statistiche passano dal merge incrementale, quindi un
+    file che si sovrappone a upload precedenti scrive solo righe nuove o modificate.
+    Ritorna l'esito strutturato (vedi _result); il messaggio lo compone la UI.
+    """
+    rows = bad = 0
+    d_min = d_max = None
+    counts = {}
+    with db_session() as conn:
+        for stat_rows, content_rows, r, b in parts:
+            add_counts(counts, write_stat_rows(conn, stat_rows, content_rows))
+            rows += r; bad += b
+            dates = [x[2] for x in stat_rows if x[2]] + [x[1] for x in content_rows[1] if x[1]]
+            if dates:
+                lo, hi = min(dates), max(dates)
+                d_min = lo if d_min is None else min(d_min, lo)
+                d_max = hi if d_max is None else max(d_max, hi)
+        overlap = find_overlapping_upload(conn, platform, d_min, d_max)
+        if rows > 0: log_upload_event(name, platform, f"OK ({rows})", file_hash, rows, d_min, d_max)
+        bump_generation() # Effettivo dopo il commit
+    return _result(rows, counts, bad, overlap)
+
+def _result(rows=0, counts=None, bad_cells=0, overlap=None, error=None):
+    # Esito di un file: righe scritte (solo valori validi), conteggi del merge {'new','changed','unchanged'},
+    # celle non valide scartate (a parte, non incluse nelle righe), upload sovrapposto, errore (None se ok)
+    return {"rows": rows, "counts": counts or {}, "bad_cells": bad_cells, "overlap": overlap, "error": error}
+
+def _write_result(platform, file_hash, name, parsed_path, msg):
+    if parsed_path is None: return _result(error=msg)
+    try: return write_parsed(name, platform, iter_parsed(parsed_path), file_hash)
+    except Exception as e: return _result(error=str(e))
+    finally: os.remove(parsed_path)
+
+# --- 3. BATCH ---
+def ingest_batch(files, platform, on_done=None, max_workers=None):
+    """
+    files: lista di (filename, percorso, file_hash), percorsi creati con spool_upload (vengono
+    cancellati a fine batch). Il parsing gira in parallelo in un process pool, le scritture su
+    SQLite restano in questo thread e partono appena un file è pronto.
+    on_done(filename, result, done, total) viene chiamato a ogni file completato (result: vedi _result).
+    Ritorna la lista di (filename, result).
+    """
+    total, results = len(files), []
+
+    def _done(name, res):
+        results.append((name, res))
+        if on_done: on_done(name, res, len(results), total)
+
+    try:
+        # Un solo file: niente pool, l'avvio dei processi costerebbe più del parsing
+        if total <= 1 or max_workers == 1:
+            for name, path, file_hash in files:
+                try: _done(name, _write_result(platform, file_hash, *parse_upload(name, path, platform)))
+                except Exception as e: _done(name, _result(error=str(e)))
+            return results
+
+        workers = min(total, max_workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(parse_upload, name, path, platform): (name, file_hash) for name, path, file_hash in files}
+            for fut in as_completed(futures):
+                name, file_hash = futures[fut]
+                try: _done(name, _write_result(platform, file_hash, *fut.result()))
+                except Exception as e: _done(name, _result(error=str(e)))
+        return results
+    finally:
+        for _, path, _ in files:
+            if os.path.exists(path): os.remove(path)
@@ -1,24 +1,16 @@
 import os
 import requests
 from bs4 import BeautifulSoup
-from PyPDF2 import PdfReader
-from database import get_connection
-
-PDF_FOLDER = "knowledge_docs"
+from database import db_session, bump_generation
+from retrieval_logic import index_document, embed_document, hybrid_search, pack_context, TOP_K, TOKEN_BUDGET
+from embedding_logic import embed_missing
+from pdf_ingest_logic import start_pdf_ingest, pdf_ingest_status, get_file_status, PDF_FOLDER
 
 def ingest_local_pdfs():
+    # Estrazione in background (process pool); lo stato si legge con pdf_ingest_status()
     if not os.path.exists(PDF_FOLDER): os.makedirs(PDF_FOLDER); return "Cartella creata."
-    files = [f for f in os.listdir(PDF_FOLDER) if f.endswith('.pdf')]
-    if not files: return "Nessun PDF."
-    conn = get_connection()
-    c = 0
-    for f in files:
-        if conn.execute("SELECT count(*) FROM knowledge_base WHERE source=?",(f"PDF:{f}",)).fetchone()[0]==0:
-            try:
-                r=PdfReader(os.path.join(PDF_FOLDER,f)); txt="\n".join([p.extract_text() for p in r.pages])
-                conn.execute("INSERT INTO knowledge_base (source,content) VALUES (?,?)",(f"PDF:{f}",txt)); c+=1
-            except: pass
-    conn.commit(); conn.close(); return f"Importati {c}"
+    if not any(f.lower().endswith('.pdf') for f in os.listdir(PDF_FOLDER)): return "Nessun PDF."
+    return "Scansione avviata." if start_pdf_ingest(PDF_FOLDER) else "Scansione già in corso."
 
 def scrape_webpage(url):
     try:
@@ -28,8 +20,18 @@ def scrape_webpage(url):
     except Exception as e: return None,str(e)
 
 def save_knowledge(s,c): 
-    conn=get_connection(); conn.execute("INSERT INTO knowledge_base (source,content) VALUES (?,?)",(s,c)); conn.commit(); conn.close()
+    with db_session() as conn:
+        doc_id=conn.execute("INSERT INTO knowledge_base (source,content) VALUES (?,?)",(s,c)).lastrowid
+        index_document(conn, doc_id, c)
+        bump_generation("kb") # solo kb_fingerprint: le cache della dashboard restano valide (dopo il commit)
+    embed_document(doc_id) # fuori dalla transazione
+
+def embed_knowledge():
+    # Recupero: passaggi salvati mentre Ollama non era raggiungibile
+    try: return f"Embedding calcolati: {embed_missing()}"
+    except Exception as e: return f"Errore embedding: {e}"
 
-def get_knowledge_context():
-    conn=get_connection(); r=conn.execute("SELECT source,content FROM knowledge_base").fetchall(); conn.close()
-    return "\n".join([f"-- {x[0]} --\n{x[1][:2000]}" for x in r]) if r else ""
\ No newline at end of file
+def get_knowledge_context(query="", k=TOP_K, token_budget=TOKEN_BUDGET):
+    """Solo i passaggi più pertinenti alla domanda (BM25 + embedding), entro token_budget. Senza domanda: nessun contesto."""
+    try: return pack_context(hybrid_search(query, k), token_budget)
+    except Exception: return ""
@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+import statistics
+from abc import ABC, abstractmethod
+from collections import deque
+
+# --- 1. CONFIGURAZIONE ---
+# Backend intercambiabili con la stessa interfaccia (chat / stream / astream), scelti con ENTERPRISE_LLM_BACKEND:
+# 'ollama' (default) o 'fake' (risposte deterministiche a velocità configurabile, senza Ollama: test e benchmark).
+# ENTERPRISE_LLM_RECORD=file.jsonl registra gli stream Ollama; il fake li riproduce con ENTERPRISE_FAKE_REPLAY.
+BACKEND = os.environ.get("ENTERPRISE_LLM_BACKEND", "ollama")
+DEFAULT_MODEL = os.environ.get("ENTERPRISE_LLM_MODEL", "mistral-nemo")  # per confrontare modelli senza toccare il codice
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST")
+RECORD_PATH = os.environ.get("ENTERPRISE_LLM_RECORD")
+REPLAY_PATH = os.environ.get("ENTERPRISE_FAKE_REPLAY")
+FAKE_TPS = float(os.environ.get("ENTERPRISE_FAKE_TPS", "25"))       # token/s simulati
+FAKE_TTFT = float(os.environ.get("ENTERPRISE_FAKE_TTFT", "0.3"))    # secondi prima del primo token
+FAKE_TOKENS = 120                                                    # lunghezza risposta sintetica
+CHARS_PER_TOKEN = 4                                                  # stessa stima di retrieval_logic
+METRICS_KEEP = 500
+
+FAKE_WORDS = ("il", "trend", "follower", "campagna", "budget", "crescita", "engagement", "ROI", "reach", "dati",
+              "contenuti", "strategia", "spesa", "stream", "conversione", "settimana", "pubblico", "costo")
+
+def estimate_tokens(text):
+    return len(text or "") // CHARS_PER_TOKEN
+
+def prompt_key(model, messages):
+    # Chiave di registrazione/riproduzione: modello + messaggi
+    payload = json.dumps([model, [{'role': m.get('role'), 'content': m.get('content')} for m in messages]], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# --- 2. METRICHE PER RICHIESTA ---
+_metrics = deque(maxlen=METRICS_KEEP)
+_metrics_lock = threading.Lock()
+
+class _Meter:
+    """Misura una richiesta in streaming; record() la aggiunge alle metriche recenti."""
+    def __init__(self, backend, model, messages):
+        self.backend, self.model = backend, model
+        self.prompt_tokens = sum(estimate_tokens(m.get('content')) for m in messages)
+        self.start, self.first, self.tokens, self.chars = time.perf_counter(), None, 0, 0
+
+    def piece(self, text):
+        if self.first is None: self.first = time.perf_counter()
+        self.tokens += 1; self.chars += len(text)
+
+    def final(self, prompt_eval=None, eval_count=None):
+        # Conteggi reali di Ollama nell'ultimo chunk, se presenti
+        if prompt_eval: self.prompt_tokens = prompt_eval
+        if eval_count: self.tokens = eval_count
+
+    def record(self, status="ok"):
+        end = time.perf_counter()
+        ttft = (self.first - self.start) if self.first else None
+        gen = end - (self.first or end)
+        m = {"backend": self.backend, "model": self.model, "status": status, "prompt_tokens": self.prompt_tokens,
+             "tokens": self.tokens, "ttft": ttft, "total": end - self.start,
+             "tokens_per_s": self.tokens / gen if gen > 0 else None, "at": time.time()}
+        with _metrics_lock: _metrics.append(m)
+        return m
+
+def recent_metrics(n=None):
+    with _metrics_lock: out = list(_metrics)
+    return out[-n:] if n else out
+
+def metrics_summary(model=None):
+    """Mediane e p95 per (backend, modello) sulle richieste recenti."""
+    groups = {}
+    for m in recent_metrics():
+        if model and m["model"] != model: continue
+        groups.setdefault((m["backend"], m["model"]), []).append(m)
+    out = []
+    for (b, mod), ms in groups.items():
+        ttft = sorted(x["ttft"] for x in ms if x["ttft"] is not None)
+        tps = [x["tokens_per_s"] for x in ms if x["tokens_per_s"]]
+        out.append({"backend": b, "model": mod, "requests": len(ms), "errors": sum(x["status"] != "ok" for x in ms),
+                    "ttft_p50": statistics.median(ttft) if ttft else None,
+                    "ttft_p95": ttft[min(len(ttft) - 1, int(len(ttft) * 0.95))] if ttft else None,
+                    "tokens_per_s": statistics.median(tps) if tps else None,
+                    "prompt_tokens": statistics.median(x["prompt_tokens"] for x in ms)})
+    return out
+
+def clear_metrics():
+    with _metrics_lock: _metrics.clear()
+
+# --- 3. BACKEND ---
+class LLMBackend(ABC):
+    """Interfaccia comune: stream()/astream() producono pezzi di testo misurati, chat() il testo completo."""
+    name = "base"
+
+    @abstractmethod
+    def _chunks(self, model, messages, options):
+        """Genera (testo, final) dove final = (prompt_eval, eval_count) nell'ultimo pezzo, altrimenti None."""
+
+    async def _achunks(self, model, messages, options):
+        # Default: lo stream sincrono in un thread, per non bloccare l'event loop
+        it = iter(self._chunks(model, messages, options))
+        done = object()
+        while True:
+            ch = await asyncio.to_thread(next, it, done)
+            if ch is done: return
+            yield ch
+
+    def stream(self, model, messages, options=None):
+        meter = _Meter(self.name, model, messages)
+        try:
+            for text, final in self._chunks(model, messages, options):
+                if text: meter.piece(text); yield text
+                if final: meter.final(*final)
+        except GeneratorExit:
+            meter.record("cancelled"); raise
+        except Exception:
+            meter.record("error"); raise
+        meter.record()
+
+    async def astream(self, model, messages, options=None):
+        meter = _Meter(self.name, model, messages)
+        try:
+            async for text, final in self._achunks(model, messages, options):
+                if text: meter.piece(text); yield text
+                if final: meter.final(*final)
+        except (GeneratorExit, asyncio.CancelledError):
+            meter.record("cancelled"); raise
+        except Exception:
+            meter.record("error"); raise
+        meter.record()
+
+    def chat(self, model, messages, options=None):
+        return "".join(self.stream(model, messages, options))
+
+class OllamaBackend(LLMBackend):
+    name = "ollama"
+
+    def __init__(self, host=OLLAMA_HOST, record_path=RECORD_PATH):
+        import ollama
+        self.host, self.record_path = host, record_path
+        self.client = ollama.Client(host=host) if host else ollama.Client()
+        self.aclient = ollama.AsyncClient(host=host) if host else ollama.AsyncClient()
+        self._record_lock = threading.Lock()
+
+    @staticmethod
+    def _final(ch):
+        return (ch.get('prompt_eval_count'), ch.get('eval_count')) if ch.get('done') else None
+
+    def _record(self, model, messages, pieces):
+        # Stream registrato per il backend fake (una riga JSON per risposta)
+        if not self.record_path: return
+        with self._record_lock, open(self.record_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": prompt_key(model, messages), "model": model, "chunks": pieces}, ensure_ascii=False) + "\n")
+
+    def _chunks(self, model, messages, options):
+        pieces = []
+        for ch in self.client.chat(model=model, messages=messages, stream=True, options=options):
+            text = ch['message']['content']; pieces.append(text)
+            yield text, self._final(ch)
+        self._record(model, messages, pieces)
+
+    async def _achunks(self, model, messages, options):
+        pieces = []
+        async for ch in await self.aclient.chat(model=model, messages=messages, stream=True, options=options):
+            text = ch['message']['content']; pieces.append(text)
+            yield text, self._final(ch)
+        self._record(model, messages, pieces)
+
+class FakeBackend(LLMBackend):
+    """
+    Risposte deterministiche (stessi messaggi = stesso testo) a FAKE_TPS token/s dopo FAKE_TTFT secondi.
+    Con un file di registrazione riproduce gli stream reali; altrimenti genera testo sintetico.
+    """
+    name = "fake"
+
+    def __init__(self, tps=FAKE_TPS, ttft=FAKE_TTFT, replay_path=REPLAY_PATH, tokens=FAKE_TOKENS):
+        self.tps, self.ttft, self.tokens = tps, ttft, tokens
+        self.recordings = {}
+        if replay_path and os.path.exists(replay_path):
+            with open(replay_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip(): r = json.loads(line); self.recordings[r["key"]] = r["chunks"]
+
+    def pieces(self, model, messages):
+        key = prompt_key(model, messages)
+        if key in self.recordings: return self.recordings[key]
+        if self.recordings:  # prompt non registrato: una registrazione scelta in modo stabile
+            keys = sorted(self.recordings)
+            return self.recordings[keys[int(key, 16) % len(keys)]]
+        rnd = random.Random(key)
+        return [rnd.choice(FAKE_WORDS) + ("." if i % 15 == 14 else "") + " " for i in range(self.tokens)]
+
+    def _chunks(self, model, messages, options):
+        pieces = self.pieces(model, messages)
+        time.sleep(self.ttft)
+        for i, p in enumerate(pieces):
+            if i and self.tps: time.sleep(1 / self.tps)
+            yield p, None
+        yield "", (None, len(pieces))
+
+    async def _achunks(self, model, messages, options):
+        pieces = self.pieces(model, messages)
+        await asyncio.sleep(self.ttft)
+        for i, p in enumerate(pieces):
+            if i and self.tps: await asyncio.sleep(1 / self.tps)
+            yield p, None
+        yield "", (None, len(pieces))
+
+BACKENDS = {"ollama": OllamaBackend, "fake": FakeBackend}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None: _backend = BACKENDS.get(BACKEND, OllamaBackend)()
+        return _backend
+
+def set_backend(backend):
+    # Test / benchmark: accetta un'istanza o un nome ('ollama', 'fake')
+    global _backend
+    with _backend_lock: _backend = BACKENDS[backend]() if isinstance(backend, str) else backend
+
+# --- 4. SCORCIATOIE ---
+def chat(model, messages, options=None):
+    return get_backend().chat(model, messages, options)
+
+def stream(model, messages, options=None):
+    return get_backend().stream(model, messages, options)
+
+def astream(model, messages, options=None):
+    return get_backend().astream(model, messages, options)
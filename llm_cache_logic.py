@@ -0,0 +1,111 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from database import db_session
+
+# --- 1. CONFIGURAZIONE ---
+# File dedicato, relativo alla cartella di lavoro come DB_NAME; ENTERPRISE_LLM_CACHE per condividerlo tra le app
+CACHE_DB = os.environ.get("ENTERPRISE_LLM_CACHE", "llm_cache.db")
+DEFAULT_TTL = 7 * 24 * 3600
+MAX_ENTRIES = 2000
+MAX_BYTES = 50 * 1024 * 1024
+_WS_RE = re.compile(r'\s+')
+
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+_ready = set()
+
+def _ensure(conn):
+    # Schema creato al primo uso, una volta per processo
+    if CACHE_DB in _ready: return
+    conn.execute('''CREATE TABLE IF NOT EXISTS llm_cache (
+                        key TEXT PRIMARY KEY,
+                        model TEXT,
+                        response TEXT,
+                        bytes INTEGER,
+                        hits INTEGER DEFAULT 0,
+                        created_at REAL,
+                        expires_at REAL,
+                        last_used REAL
+                    ) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_used ON llm_cache(last_used)")
+    _ready.add(CACHE_DB)
+
+def _count(name, n=1):
+    with _stats_lock: _stats[name] += n
+
+# --- 2. CHIAVE ---
+def normalize_messages(messages):
+    """Ruolo + testo con spazi compattati: differenze di formattazione non creano voci diverse."""
+    return [{'role': (m.get('role') or '').strip().lower(), 'content': _WS_RE.sub(' ', m.get('content') or '').strip()} for m in messages]
+
+def cache_key(model, messages, version="", options=None):
+    payload = json.dumps([model, normalize_messages(messages), str(version), options or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# --- 3. LETTURA / SCRITTURA ---
+def lookup(model, messages, version="", options=None):
+    """Risposta in cache (non scaduta) o None."""
+    key, now = cache_key(model, messages, version, options), time.time()
+    with db_session(CACHE_DB) as conn:
+        _ensure(conn)
+        r = conn.execute("SELECT response FROM llm_cache WHERE key=? AND expires_at>?", (key, now)).fetchone()
+        if r: conn.execute("UPDATE llm_cache SET hits=hits+1, last_used=? WHERE key=?", (now, key))
+    _count("hits" if r else "misses")
+    return r[0] if r else None
+
+def store(model, messages, response, version="", options=None, ttl=DEFAULT_TTL):
+    if not response: return
+    now = time.time()
+    with db_session(CACHE_DB) as conn:
+        _ensure(conn)
+        conn.execute("""INSERT OR REPLACE INTO llm_cache (key, model, response, bytes, hits, created_at, expires_at, last_used)
+                        VALUES (?,?,?,?,0,?,?,?)""",
+                     (cache_key(model, messages, version, options), model, response, len(response.encode("utf-8")), now, now + ttl, now))
+        evict(conn, now)
+    _count("stores")
+
+def evict(conn, now=None):
+    """Toglie le voci scadute, poi le meno usate di recente finché si rientra in MAX_ENTRIES / MAX_BYTES."""
+    n = conn.execute("DELETE FROM llm_cache WHERE expires_at<=?", (now or time.time(),)).rowcount
+    count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes),0) FROM llm_cache").fetchone()
+    if count > MAX_ENTRIES or size > MAX_BYTES:
+        drop, freed = 0, 0
+        for _, b in conn.execute("SELECT key, bytes FROM llm_cache ORDER BY last_used"):
+            if count - drop <= MAX_ENTRIES and size - freed <= MAX_BYTES: break
+            drop += 1; freed += b
+        n += conn.execute("DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_used LIMIT ?)", (drop,)).rowcount
+    if n: _count("evictions", n)
+    return n
+
+def cached_chat(model, messages, version="", options=None, ttl=DEFAULT_TTL, chat=None):
+    """
+    Chat non in streaming con cache: stessa richiesta (modello, messaggi normalizzati, versione dati)
+    = risposta salvata. `chat(model, messages, options) -> testo`; default il backend di llm_backend.
+    """
+    hit = lookup(model, messages, version, options)
+    if hit is not None: return hit
+    if chat is None:
+        import llm_backend
+        chat = llm_backend.chat
+    text = chat(model, messages, options)
+    store(model, messages, text, version, options, ttl)
+    return text
+
+# --- 4. METRICHE ---
+def cache_stats():
+    with _stats_lock: s = dict(_stats)
+    lookups = s["hits"] + s["misses"]
+    s["hit_rate"] = s["hits"] / lookups if lookups else 0.0
+    with db_session(CACHE_DB) as conn:
+        _ensure(conn)
+        s["entries"], s["bytes"], s["total_hits"] = conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes),0), COALESCE(SUM(hits),0) FROM llm_cache").fetchone()
+    return s
+
+def clear_cache():
+    with db_session(CACHE_DB) as conn:
+        _ensure(conn)
+        conn.execute("DELETE FROM llm_cache")
@@ -9,8 +9,8 @@ from plotly.subplots import make_subplots
 from datetime import datetime
 
 # IMPORT MODULI
-from database import init_advanced_db, get_connection
-from social_logic import smart_csv_loader, detect_metric_from_filename, save_social_bulk, get_data_health, check_file_log, log_upload_event, get_file_upload_history, get_content_health
+from database import init_advanced_db
+from social_logic import smart_csv_loader, detect_metric_from_filename, save_social_bulk, get_data_health, query_stats, get_platforms, check_file_log, file_fingerprint, log_upload_event, get_file_upload_history, get_content_health, reset_social_data
 from knowledge_logic import ingest_local_pdfs, scrape_webpage, save_knowledge, get_knowledge_context
 from campaign_logic import get_campaigns, save_campaign
 from spotify_client import SpotifyAPI
@@ -41,8 +41,7 @@ with st.sidebar:
     st.divider()
     st.header("🔍 Filtri Globali")
     
-    _, df_stats_all = get_data_health()
-    if not df_stats_all.empty: df_stats_all.columns = ['date_recorded', 'platform', 'metric_type', 'value']
+    df_stats_all = query_stats(tuple(get_platforms()), limit=-1) # -1 = nessun limite (SQLite)
     df_content_all = get_content_health()
     
     plats = sorted(list(set(df_stats_all['platform'].unique().tolist() + df_content_all['platform'].unique().tolist()))) if not df_stats_all.empty else []
@@ -130,7 +129,8 @@ if nav == "📈 Social Tracker":
             cnt = 0
             bar = st.progress(0)
             for i, f in enumerate(up):
-                ex, _ = check_file_log(f.name, plat)
+                f_hash = file_fingerprint(f)
+                ex, _ = check_file_log(f_hash, plat)
                 if ex and not force: st.toast(f"Saltato {f.name}")
                 else:
                     m = detect_metric_from_filename(f.name)
@@ -138,7 +138,7 @@ if nav == "📈 Social Tracker":
                     if df is not None:
                         rows, msg = save_social_bulk(df, plat, m)
                         if rows > 0: 
-                            log_upload_event(f.name, plat, f"OK {rows}")
+                            log_upload_event(f.name, plat, f"OK {rows}", file_hash=f_hash)
                             cnt += 1
                             st.toast(f"✅ {f.name}: {rows}")
                         else: st.error(f"❌ {f.name}: 0 righe ({msg})")
@@ -152,10 +152,7 @@ if nav == "📈 Social Tracker":
                 st.rerun()
 
     if st.button("🗑️ RESET"):
-        conn = get_connection()
-        conn.execute("DELETE FROM social_stats"); conn.execute("DELETE FROM upload_logs")
-        conn.execute("DELETE FROM posts_inventory"); conn.execute("DELETE FROM posts_performance")
-        conn.commit(); conn.close()
+        reset_social_data() # social_stats è una vista: si svuotano fatti, dimensioni e rollup
         st.warning("Reset!")
         time.sleep(1); st.rerun()
 
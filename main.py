@@ -1,20 +1,26 @@
 import streamlit as st
 import pandas as pd
-import threading
 import time
 import uuid
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from datetime import datetime
+from datetime import date
 
 # IMPORT MODULI
-from database import init_advanced_db, get_connection
-from social_logic import smart_csv_loader, detect_metric_from_filename, save_social_bulk, get_data_health, check_file_log, log_upload_event, get_file_upload_history, get_content_health
-from knowledge_logic import ingest_local_pdfs, scrape_webpage, save_knowledge, get_knowledge_context
+from database import init_advanced_db, db_session
+from social_logic import get_data_health, check_file_log, file_fingerprint, get_content_health, reset_social_data, query_stats, count_stats, get_platforms, get_metric_names, get_date_bounds
+from ingest_logic import ingest_batch, spool_upload
+from rollup_logic import get_trend_metrics, get_trend, get_audience_latest, get_audience_pivot
+from analytics_logic import install_extension
+from warehouse_logic import export_snapshot, snapshot_info, snapshot_fresh, get_social_context, available as warehouse_available
+from knowledge_logic import ingest_local_pdfs, scrape_webpage, save_knowledge, get_knowledge_context, embed_knowledge, pdf_ingest_status, get_file_status
 from campaign_logic import get_campaigns, save_campaign
 from spotify_client import SpotifyAPI
-from ai_engine import ai_thread, load_chat_history, save_chat_message, clear_chat_history
+from llm_cache_logic import cache_stats
+from llm_backend import metrics_summary
+from memory_logic import fold_error
+from ai_engine import start_chat, poll_chat, cancel_chat, active_chat, load_chat_history, has_older, save_chat_message, clear_chat_history, create_session, list_sessions, archive_session, CHAT_SESSION
 
 st.set_page_config(page_title="YANGKIDD ENTERPRISE OS", page_icon="💎", layout="wide")
 st.markdown("""
@@ -28,10 +34,16 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 init_advanced_db()
-if 'init' not in st.session_state:
-    try: hist = load_chat_history()
+install_extension() # estensione sqlite di DuckDB: una volta per processo, offline si resta su SQLite
+def open_session(sid):
+    # Solo l'ultima pagina di messaggi: le precedenti si caricano su richiesta
+    try: hist = load_chat_history(sid)
     except: hist = []
-    st.session_state.update({'init':True, 'messages':hist, 'thinking':False})
+    st.session_state.update({'chat_sid':sid, 'messages':hist, 'has_more':bool(hist) and has_older(sid, hist[0]['id']), 'job':active_chat(sid), 'partial':""})
+
+if 'init' not in st.session_state:
+    st.session_state.update({'init':True, 'thinking':False})
+    open_session(CHAT_SESSION)
 
 # --- SIDEBAR & FILTRI ---
 with st.sidebar:
@@ -42,22 +54,22 @@ with st.sidebar:
     st.header("🔍 Filtri Globali")
     
     # Initialize DataFrames
-    df_stats_filtered = pd.DataFrame()
     df_content_filtered = pd.DataFrame()
-    df_time = pd.DataFrame()
-    df_demo = pd.DataFrame()
-    
-    _, df_stats_all = get_data_health()
-    if not df_stats_all.empty: df_stats_all.columns = ['date_recorded', 'platform', 'metric_type', 'value']
     df_content_all = get_content_health()
     
     # Recupera tutte le piattaforme uniche dal DB
-    plats_1 = df_stats_all['platform'].unique().tolist() if not df_stats_all.empty else []
-    plats_2 = df_content_all['platform'].unique().tolist() if not df_content_all.empty else []
-    available_plats = sorted(list(set(plats_1 + plats_2)))
+    available_plats = get_platforms()
     
+    date_from = date_to = None
+    sel_mets = []
     if available_plats:
         sel_plats = st.multiselect("Piattaforme Visualizzate", available_plats, default=available_plats)
+        sel_mets = st.multiselect("Metriche", get_metric_names(tuple(sel_plats)), placeholder="Tutte")
+        d_min, d_max = get_date_bounds()
+        if d_min and d_max:
+            d_min, d_max = date.fromisoformat(d_min[:10]), date.fromisoformat(d_max[:10])
+            period = st.date_input("Periodo", (d_min, d_max), min_value=d_min, max_value=d_max)
+            if len(period) == 2: date_from, date_to = period
     else:
         sel_plats = []
         st.caption("Nessun dato. Carica file CSV.")
@@ -72,15 +84,6 @@ if nav == "📈 Social Tracker":
 
     st.subheader("📊 Analisi Visuale")
     
-    # FILTRAGGIO DATI (SE CI SONO)
-    if not df_stats_all.empty:
-        df_stats_filtered = df_stats_all[df_stats_all['platform'].isin(sel_plats)]
-        if not df_stats_filtered.empty:
-            df_stats_filtered['date_recorded'] = pd.to_datetime(df_stats_filtered['date_recorded'])
-            is_demo = df_stats_filtered['metric_type'].str.contains("Audience", case=False, na=False)
-            df_time = df_stats_filtered[~is_demo]
-            df_demo = df_stats_filtered[is_demo]
-
     if not df_content_all.empty:
         df_content_filtered = df_content_all[df_content_all['platform'].isin(sel_plats)]
 
@@ -88,15 +91,19 @@ if nav == "📈 Social Tracker":
     tab1, tab2, tab3, tab4 = st.tabs(["📉 Trend", "🎬 Content", "👥 Demografica", "🔢 Dati"])
     
     with tab1:
-        if not df_time.empty:
+        # Punti pre-aggregati (stats_rollup): niente scansione delle righe grezze
+        trend_metrics = [m for m in get_trend_metrics(tuple(sel_plats)) if not sel_mets or m in sel_mets]
+        if trend_metrics:
             c1, c2 = st.columns([1,3])
             with c1:
-                metrics = sorted(df_time['metric_type'].unique())
-                main_met = [m for m in metrics if "Active H" not in m]
-                sel_met = st.multiselect("Metriche (Max 2)", metrics, default=main_met[:2], max_selections=2)
+                main_met = [m for m in trend_metrics if "Active H" not in m]
+                sel_met = st.multiselect("Metriche (Max 2)", trend_metrics, default=main_met[:2], max_selections=2)
+                grain = {"Giorno": "D", "Settimana": "W", "Mese": "M"}[st.radio("Granularità", ["Giorno", "Settimana", "Mese"], horizontal=True)]
+                agg = {"Somma": "value_sum", "Media": "value_avg", "Ultimo": "value_last"}[st.selectbox("Aggregazione", ["Somma", "Media", "Ultimo"], disabled=grain == "D")]
             with c2:
                 if len(sel_met) > 0:
-                    df_p = df_time[df_time['metric_type'].isin(sel_met)]
+                    df_p = get_trend(tuple(sel_plats), tuple(sel_met), grain, date_from, date_to)
+                    df_p['value'] = df_p[agg]
                     if len(sel_met) == 1:
                         fig = px.line(df_p, x='date_recorded', y='value', color='platform', markers=True, template="plotly_dark", title=sel_met[0])
                         st.plotly_chart(fig, use_container_width=True)
@@ -124,23 +131,33 @@ if nav == "📈 Social Tracker":
         else: st.info("Nessun contenuto.")
 
     with tab3:
-        if not df_demo.empty:
-            latest = df_demo['date_recorded'].max()
-            df_s = df_demo[df_demo['date_recorded'] == latest]
+        df_s = get_audience_latest(tuple(sel_plats))
+        if not df_s.empty:
             c1, c2 = st.columns(2)
             with c1:
-                df_g = df_s[df_s['metric_type'].str.contains("Gender")]
+                df_g = df_s[df_s['dimension'] == "Gender"]
                 if not df_g.empty:
-                    df_g['label'] = df_g['metric_type'].str.replace("Audience Gender ", "")
                     st.plotly_chart(px.pie(df_g, values='value', names='label', facet_col='platform', title="Genere", template="plotly_dark"), use_container_width=True)
             with c2:
-                df_geo = df_s[df_s['metric_type'].str.contains("Geo")]
+                df_geo = df_s[df_s['dimension'] == "Geo"]
                 if not df_geo.empty:
-                    df_geo['label'] = df_geo['metric_type'].str.replace("Audience Geo ", "")
                     st.plotly_chart(px.bar(df_geo, x='label', y='value', color='platform', barmode='group', title="Geo", template="plotly_dark"), use_container_width=True)
+            df_piv = get_audience_pivot(tuple(sel_plats))
+            if not df_piv.empty:
+                st.caption("Età × Genere (ultima fotografia per piattaforma)")
+                st.dataframe(df_piv, use_container_width=True)
         else: st.info("Nessun dato demografico.")
 
-    with tab4: st.dataframe(df_stats_filtered, use_container_width=True)
+    with tab4:
+        # Paginazione lato SQL: tutto lo storico è raggiungibile senza caricarlo in memoria
+        filters = (tuple(sel_plats), tuple(sel_mets), date_from, date_to)
+        total = count_stats(*filters)
+        c1, c2 = st.columns([1,3])
+        page_size = c1.selectbox("Righe per pagina", [100, 500, 1000, 5000], index=2)
+        pages = max(1, -(-total // page_size))
+        page = c2.number_input("Pagina", min_value=1, max_value=pages, value=1)
+        st.caption(f"{total} righe · pagina {page}/{pages}")
+        st.dataframe(query_stats(*filters, limit=page_size, offset=(page - 1) * page_size), use_container_width=True)
 
     # UPLOAD
     with st.expander("📂 Upload CSV", expanded=True):
@@ -151,28 +168,32 @@ if nav == "📈 Social Tracker":
         force = c2.checkbox("Forza reload")
         
         if st.button("🚀 Elabora"):
-            cnt = 0
             bar = st.progress(0)
-            for i, f in enumerate(up_files):
-                exists, _ = check_file_log(f.name, plat)
+            todo = []
+            for f in up_files:
+                # Dedup per contenuto: stesso nome ma dati nuovi viene elaborato, una copia rinominata no
+                f_hash = file_fingerprint(f)
+                exists, _ = check_file_log(f_hash, plat)
                 
                 # SE FORZA RELOAD E' ATTIVO, IGNORIAMO LO STORICO
                 if exists and not force: 
                     st.toast(f"⏭️ Saltato {f.name}")
                 else:
-                    m = detect_metric_from_filename(f.name)
-                    df, msg = smart_csv_loader(f)
-                    
-                    if df is not None:
-                        rows, msg = save_social_bulk(df, plat, m)
-                        if rows > 0: 
-                            log_upload_event(f.name, plat, f"OK ({rows})")
-                            cnt += 1
-                            st.toast(f"✅ {f.name}: {rows} rows")
-                        else:
-                            st.error(f"❌ {f.name}: {msg}") # MOSTRA ERRORE ESPLICITO
-                    else:
-                        st.error(f"❌ {f.name}: {msg}") # MOSTRA ERRORE CSV
+                    todo.append((f.name, spool_upload(f), f_hash)) # su disco: i worker leggono il file, non una copia in memoria
+
+            def on_file_done(name, res, done, total):
+                bar.progress(int(done / total * 100))
+                if res["rows"] > 0:
+                    c = res["counts"]
+                    st.toast(f"✅ {name}: {res['rows']} rows (+{c.get('new', 0)} nuove, ~{c.get('changed', 0)} modificate, ={c.get('unchanged', 0)} invariate)")
+                    if res["bad_cells"]: st.warning(f"⚠️ {name}: {res['bad_cells']} valori non validi ignorati")
+                    if res["overlap"]: st.info(f"ℹ️ {name}: sovrapposto a {res['overlap']}")
+                else:
+                    st.error(f"❌ {name}: {res['error'] or '0 righe valide'}") # MOSTRA ERRORE ESPLICITO
+
+            # Parsing in parallelo (process pool), scrittura su SQLite da un solo writer
+            results = ingest_batch(todo, plat, on_file_done)
+            cnt = sum(1 for _, res in results if res["rows"] > 0)
                         
             bar.progress(100)
             if cnt > 0:
@@ -181,34 +202,102 @@ if nav == "📈 Social Tracker":
                 st.session_state["uploader_key"] = str(uuid.uuid4())
                 st.rerun()
     
+    # SNAPSHOT COLONNARE (Parquet per piattaforma/mese, letto da analisi e contesto AI)
+    with st.expander("📦 Snapshot Parquet"):
+        info = snapshot_info()
+        st.caption(f"Ultimo snapshot: {info['created']} · {info['rows']}" if info else "Nessuno snapshot.")
+        if info and not snapshot_fresh(info): st.caption("⚠️ Dati cambiati dopo l'export: il contesto AI legge da SQLite finché non riesporti.")
+        if st.button("Esporta snapshot", disabled=not warehouse_available()):
+            ok, res = export_snapshot()
+            if ok: st.success(f"Snapshot scritto: {res}")
+            else: st.error(res)
+        if not warehouse_available(): st.caption("Installa pyarrow per abilitare l'export.")
+
     # RESET BUTTON
     if st.button("🗑️ RESET DATABASE"):
-        conn = get_connection()
-        conn.execute("DELETE FROM social_stats"); conn.execute("DELETE FROM upload_logs"); 
-        conn.execute("DELETE FROM posts_inventory"); conn.execute("DELETE FROM posts_performance");
-        conn.commit(); conn.close()
+        reset_social_data()
         st.warning("Database pulito.")
         time.sleep(1); st.rerun()
 
 # --- ALTRE PAGINE ---
 elif nav == "💬 Strategy":
     st.title("🧠 Strategy Room")
-    if st.button("Clear Chat"): clear_chat_history(); st.session_state.messages=[]; st.rerun()
+    sessions = list_sessions()
+    ids = [r[0] for r in sessions]
+    if st.session_state.chat_sid not in ids: ids.insert(0, st.session_state.chat_sid)
+    titles = {r[0]: r[1] for r in sessions}
+    c1, c2, c3, c4 = st.columns([4, 1, 1, 1])
+    sid = c1.selectbox("Sessione", ids, index=ids.index(st.session_state.chat_sid), format_func=lambda i: titles.get(i, i))
+    if sid != st.session_state.chat_sid: open_session(sid); st.rerun()
+    if c2.button("➕ Nuova"): open_session(create_session()); st.rerun()
+    if c3.button("🗄️ Archivia") and sid != CHAT_SESSION:
+        archive_session(sid); open_session(CHAT_SESSION); st.rerun()
+    if c4.button("Clear Chat"):
+        if st.session_state.job: cancel_chat(st.session_state.job)
+        clear_chat_history(sid); open_session(sid); st.rerun()
+    use_cache = st.toggle("⚡ Cache risposte (stessa domanda, dati invariati)", key="use_llm_cache")
+    if use_cache:
+        cs = cache_stats()
+        st.caption(f"Cache LLM: {cs['hits']} hit / {cs['misses']} miss ({cs['hit_rate']:.0%}) · {cs['entries']} risposte, {cs['bytes']/1024:.0f} KB")
+    with st.expander("📈 Metriche LLM (richieste recenti)"):
+        ms = metrics_summary()
+        if ms: st.dataframe(pd.DataFrame(ms), hide_index=True)
+        else: st.caption("Nessuna richiesta ancora.")
+    with st.expander("Sessioni archiviate"):
+        for r in list_sessions(archived=True):
+            if st.button(f"♻️ {r[1]}", key=f"unarch_{r[0]}"): archive_session(r[0], False); open_session(r[0]); st.rerun()
+
+    if st.session_state.has_more and st.button("⬆️ Carica precedenti"):
+        older = load_chat_history(sid, before_id=st.session_state.messages[0]['id'])
+        st.session_state.messages = older + st.session_state.messages
+        st.session_state.has_more = bool(older) and has_older(sid, older[0]['id'])
+        st.rerun()
+    if err := fold_error(sid): st.warning(f"Memoria della chat non aggiornata: {err}")
     for m in st.session_state.messages: st.chat_message(m["role"]).write(m["content"])
     if p:=st.chat_input():
-        st.session_state.messages.append({"role":"user","content":p})
-        save_chat_message("user",p)
-        threading.Thread(target=ai_thread, args=(st.session_state.messages,"","", "", st.session_state.buf if 'buf' in st.session_state else None)).start()
+        mid = save_chat_message("user", p, sid)
+        st.session_state.messages.append({"id":mid,"role":"user","content":p})
+        sp_api = SpotifyAPI(); sp_fetch = sp_api.data if sp_api.tok else "" # chiamata API al massimo ogni 10 minuti
+        # Un nuovo prompt annulla la generazione ancora in corso per questa sessione
+        st.session_state.job = start_chat(sid, sp_fetch, get_knowledge_context(p), get_social_context(tuple(sel_plats)), use_cache=use_cache)
+        st.session_state.partial = ""
+        st.rerun()
+
+    @st.fragment(run_every=0.4)
+    def live_reply():
+        # Solo questo frammento si aggiorna durante lo streaming: lo storico non viene ridisegnato
+        if not st.session_state.job: return
+        delta, status, err = poll_chat(st.session_state.job, len(st.session_state.partial))
+        st.session_state.partial += delta
+        if status in ("queued", "running"):
+            st.chat_message("assistant").write(st.session_state.partial + " ▌")
+            if st.button("⏹ Stop"): cancel_chat(st.session_state.job)
+            return
+        txt = st.session_state.partial if status == "done" else f"{st.session_state.partial}\n\n_(Generazione {status}{': ' + err if err else ''})_"
+        st.session_state.messages.append({"id":None,"role":"assistant","content":txt})
+        st.session_state.update(job=None, partial="")
         st.rerun()
+    if st.session_state.job: live_reply()
 
 elif nav == "📚 Knowledge":
     st.title("Knowledge Base")
     t1, t2 = st.tabs(["PDF", "Web"])
-    with t1: st.write(ingest_local_pdfs() if st.button("Scan PDF") else "")
+    with t1:
+        if st.button("Scan PDF"): st.write(ingest_local_pdfs())
+        job = pdf_ingest_status()
+        if job.get("phase"):
+            done, total = job["pages_done"], job["pages_total"]
+            st.progress(done / total if total else 0.0, text=f"{job['phase']}: {job['files_done']}/{job['files_total']} file · {done}/{total} pagine")
+            for f, err in job["errors"]: st.error(f"❌ {f}: {err}")
+        files = get_file_status()
+        if files: st.dataframe(pd.DataFrame(files, columns=["file", "stato", "pagine", "totale", "errore", "aggiornato"]), use_container_width=True)
+        if job.get("running"): time.sleep(1); st.rerun()
     with t2:
         u = st.text_input("URL")
         if st.button("Scrape") and u: save_knowledge("WEB: "+u, scrape_webpage(u)[1]); st.success("OK")
-    conn=get_connection(); k=pd.read_sql("SELECT * FROM knowledge_base",conn); conn.close(); st.dataframe(k)
+    if st.button("🧠 Calcola embeddings mancanti"): st.write(embed_knowledge())
+    with db_session() as conn: k=pd.read_sql("SELECT * FROM knowledge_base",conn)
+    st.dataframe(k)
 
 elif nav == "🔌 API":
     st.title("API Connect")
@@ -0,0 +1,172 @@
+import os
+import threading
+from database import db_session, DB_NAME, CHAT_SUMMARIES_SQL
+from retrieval_logic import estimate_tokens
+from generation_logic import get_service, PRIORITY_BACKGROUND
+import llm_backend
+
+# --- 1. CONFIGURAZIONE ---
+# ENTERPRISE_SUMMARIZER: 'llm' (default, backend di llm_backend) o 'stub' (estrattivo, per test offline)
+SUMMARIZER = os.environ.get("ENTERPRISE_SUMMARIZER", "llm")
+SUMMARY_MODEL = os.environ.get("ENTERPRISE_SUMMARY_MODEL", llm_backend.DEFAULT_MODEL)  # di default lo stesso modello della chat
+KEEP_TURNS = 6                  # turni (domanda + risposta) inviati parola per parola
+KEEP_MESSAGES = KEEP_TURNS * 2
+FOLD_MIN = 4                    # messaggi usciti dalla finestra prima di riassumere (evita una chiamata a turno)
+WINDOW_MAX = KEEP_MESSAGES * 2  # tetto della finestra se il riassunto resta indietro (modello occupato o in errore)
+SUMMARY_TOKENS = 400            # tetto del riassunto: il prompt resta limitato anche dopo mesi
+FOLD_SUFFIX = ":memoria"        # chiave del job di riassunto sul servizio (non annulla la risposta della sessione)
+# Dove vive la storia: (DB, tabella con id, session_id, role, content); i riassunti stanno in chat_summaries dello stesso DB
+HISTORY = (DB_NAME, "chat_history")
+
+SUMMARY_PROMPT = """Aggiorna la memoria di una conversazione tra un artista e il suo manager AI.
+Tieni: decisioni prese, numeri citati, obiettivi, domande aperte. Scarta saluti e ripetizioni.
+Massimo {words} parole, elenco puntato, in italiano."""
+
+# --- 2. RIASSUNTORI ---
+class LLMSummarizer:
+    def __init__(self, model=SUMMARY_MODEL):
+        self.model = model
+
+    options = {'temperature': 0}
+
+    def prompt(self, previous, messages):
+        # Messaggi per il modello: usati anche dal job di riassunto sul servizio di generazione
+        text = "\n".join(f"{m['role'].upper()}: {m['content']}" for m in messages)
+        user = (f"MEMORIA PRECEDENTE:\n{previous}\n\n" if previous else "") + f"NUOVI MESSAGGI:\n{text}"
+        return [{'role': 'system', 'content': SUMMARY_PROMPT.format(words=SUMMARY_TOKENS * 3 // 4)},
+                {'role': 'user', 'content': user}]
+
+    def summarize(self, previous, messages):
+        return llm_backend.chat(self.model, self.prompt(previous, messages), self.options)
+
+class StubSummarizer:
+    """Prima frase di ogni messaggio: nessuna rete, risultato stabile."""
+    def summarize(self, previous, messages):
+        lines = [f"- {m['role']}: {m['content'].strip().split('. ')[0][:160]}" for m in messages if m['content'].strip()]
+        return "\n".join(([previous] if previous else []) + lines)
+
+_summarizer = None
+
+def get_summarizer():
+    global _summarizer
+    if _summarizer is None:
+        _summarizer = StubSummarizer() if SUMMARIZER == "stub" else LLMSummarizer()
+    return _summarizer
+
+def set_summarizer(summarizer):
+    global _summarizer
+    _summarizer = summarizer
+
+def _cap(text):
+    # Tiene la parte più recente: nel riassunto rolling le informazioni nuove sono in fondo
+    text = (text or "").strip()
+    if estimate_tokens(text) <= SUMMARY_TOKENS: return text
+    cut = text[-SUMMARY_TOKENS * 4:]
+    nl = cut.find("\n")
+    return cut[nl + 1:] if 0 <= nl < len(cut) // 2 else cut
+
+# --- 3. LETTURA / SCRITTURA ---
+# Riassunto e finestra usano gli stessi id del DB: il riassunto copre i messaggi fino a upto_id,
+# il prompt riceve quelli successivi. Nessun messaggio resta fuori da entrambi.
+def init_memory(db_path=DB_NAME):
+    # App con un DB proprio (il DB principale crea la tabella nella migrazione M10)
+    with db_session(db_path) as conn: conn.execute(CHAT_SUMMARIES_SQL)
+
+def latest_summary(conn, session_id):
+    """(id dell'ultimo messaggio riassunto, testo); (0, '') se non c'è ancora un riassunto."""
+    r = conn.execute("SELECT upto_id, content FROM chat_summaries WHERE session_id=? ORDER BY upto_id DESC LIMIT 1", (session_id,)).fetchone()
+    return (r[0], r[1]) if r else (0, "")
+
+def _pending(session_id, keep, history):
+    # (riassunto precedente, messaggi dopo upto_id esclusi gli ultimi `keep`): quelli da riassumere
+    db_path, table = history
+    with db_session(db_path) as conn:
+        upto, prev = latest_summary(conn, session_id)
+        rows = conn.execute(f"SELECT id, role, content FROM {table} WHERE session_id=? AND id>? ORDER BY id DESC LIMIT -1 OFFSET ?",
+                            (session_id, upto, keep)).fetchall()[::-1]
+    return prev, rows
+
+def _as_messages(rows):
+    return [{'role': r[1], 'content': r[2]} for r in rows]
+
+def _store_summary(session_id, upto_id, text, history):
+    db_path, table = history
+    text = _cap(text)
+    with db_session(db_path) as conn:
+        # Storia cancellata mentre il riassunto era in corso: non si scrive
+        if not conn.execute(f"SELECT 1 FROM {table} WHERE id=? AND session_id=?", (upto_id, session_id)).fetchone(): return
+        conn.execute("INSERT OR REPLACE INTO chat_summaries (session_id, upto_id, content, tokens) VALUES (?,?,?,?)",
+                     (session_id, upto_id, text, estimate_tokens(text)))
+        # Solo l'ultimo riassunto serve al prompt: i precedenti sono già inclusi
+        conn.execute("DELETE FROM chat_summaries WHERE session_id=? AND upto_id<?", (session_id, upto_id))
+
+def fold_history(session_id, summarizer=None, keep=KEEP_MESSAGES, history=HISTORY):
+    """
+    Riassume, nel thread chiamante, i messaggi usciti dalla finestra degli ultimi `keep` insieme al
+    riassunto precedente. Ritorna il numero di messaggi riassunti (0 se non ce ne sono abbastanza).
+    """
+    prev, rows = _pending(session_id, keep, history)
+    if len(rows) < FOLD_MIN: return 0
+    # Chiamata al modello fuori dalla transazione: può durare secondi
+    _store_summary(session_id, rows[-1][0], (summarizer or get_summarizer()).summarize(prev, _as_messages(rows)), history)
+    return len(rows)
+
+# Ultimo errore di riassunto per sessione: la UI lo mostra (fold_error), un riassunto riuscito lo cancella
+_errors = {}
+_errors_lock = threading.Lock()
+
+def _set_error(session_id, err):
+    with _errors_lock:
+        if err: _errors[session_id] = err
+        else: _errors.pop(session_id, None)
+
+def fold_error(session_id):
+    with _errors_lock: return _errors.get(session_id)
+
+def schedule_fold(session_id, keep=KEEP_MESSAGES, history=HISTORY, service=None):
+    """
+    Da chiamare dopo il salvataggio di una risposta. Se ci sono almeno FOLD_MIN messaggi fuori dalla
+    finestra, accoda il riassunto sul servizio di generazione con priorità bassa: usa la stessa coda
+    (e la stessa CPU) delle risposte senza passare loro davanti. Al massimo uno per sessione.
+    Con un riassuntore senza modello (stub) lavora subito. Ritorna True se il riassunto è partito.
+    """
+    try:
+        summarizer = get_summarizer()
+        if not hasattr(summarizer, "prompt"):
+            n = fold_history(session_id, summarizer, keep, history); _set_error(session_id, None)
+            return n > 0
+        service = service or get_service()
+        key = session_id + FOLD_SUFFIX
+        if service.active_job(key): return False
+        prev, rows = _pending(session_id, keep, history)
+        if len(rows) < FOLD_MIN: return False
+        upto = rows[-1][0]
+
+        def on_done(job):
+            if job.outcome == "done": _store_summary(session_id, upto, job.text, history); _set_error(session_id, None)
+            elif job.outcome == "error": _set_error(session_id, job.error)
+
+        job = service.submit(key, summarizer.prompt(prev, _as_messages(rows)), summarizer.model, summarizer.options,
+                             on_done=on_done, priority=PRIORITY_BACKGROUND)
+        if job.status == "rejected": _set_error(session_id, job.error)
+        return job.status != "rejected"
+    except Exception as e:
+        # La risposta è già salvata: un riassunto fallito si segnala senza propagare
+        _set_error(session_id, str(e))
+        return False
+
+def chat_memory(session_id, keep=KEEP_MESSAGES, history=HISTORY):
+    """
+    Storia per il prompt, letta dal DB: (riassunto fino a upto_id, messaggi con id > upto_id).
+    Di norma la finestra è di `keep` messaggi più quelli in attesa del riassunto; se il riassunto
+    resta indietro si tronca a WINDOW_MAX, così il prompt resta limitato.
+    """
+    db_path, table = history
+    with db_session(db_path) as conn:
+        upto, summary = latest_summary(conn, session_id)
+        rows = conn.execute(f"SELECT id, role, content FROM {table} WHERE session_id=? AND id>? ORDER BY id DESC LIMIT ?",
+                            (session_id, upto, max(keep, WINDOW_MAX))).fetchall()
+    return summary, _as_messages(rows[::-1])
+
+def clear_memory(conn, session_id):
+    conn.execute("DELETE FROM chat_summaries WHERE session_id=?", (session_id,))
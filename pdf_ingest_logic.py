@@ -0,0 +1,151 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from database import db_session, close_connections, bump_generation
+from retrieval_logic import index_document, embed_document
+
+# --- 1. CONFIGURAZIONE ---
+PDF_FOLDER = "knowledge_docs"
+PAGE_BATCH = 25          # pagine per task del process pool (e per transazione)
+HASH_BLOCK = 1024 * 1024
+
+_job = {"running": False}
+_job_lock = threading.Lock()
+
+# --- 2. WORKER (PROCESSO SEPARATO) ---
+def count_pages(path):
+    from PyPDF2 import PdfReader
+    return len(PdfReader(path).pages)
+
+def extract_pages(path, pages):
+    """Testo delle pagine richieste: lista di (numero pagina, testo)."""
+    from PyPDF2 import PdfReader
+    r = PdfReader(path)
+    return [(i, r.pages[i].extract_text() or "") for i in pages]
+
+# --- 3. SCANSIONE (MTIME + HASH) ---
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""): h.update(block)
+    return h.hexdigest()
+
+def plan_files(folder):
+    """
+    Confronta la cartella con knowledge_files: mtime/dimensione invariati = nessun lavoro;
+    se cambiano si ricalcola l'hash e si rielabora solo se il contenuto è diverso.
+    I PDF importati dalla versione precedente (knowledge_base 'PDF:nome') vengono adottati senza riestrarli.
+    Ritorna la lista dei nomi file da elaborare (nuovi, modificati o interrotti).
+    """
+    with db_session() as conn:
+        known = {r[0]: r[1:] for r in conn.execute("SELECT path, mtime, size, sha256, status FROM knowledge_files")}
+    todo = []
+    for name in sorted(f for f in os.listdir(folder) if f.lower().endswith('.pdf')):
+        full = os.path.join(folder, name)
+        st = os.stat(full)
+        row = known.get(name)
+        if row and row[0] == st.st_mtime and row[1] == st.st_size and row[3] == 'done': continue
+        digest = file_sha256(full) # fuori dalla transazione: l'hash dei libri grandi non blocca le scritture
+        with db_session() as conn: # una transazione per file
+            if row and row[2] == digest:
+                conn.execute("UPDATE knowledge_files SET mtime=?, size=? WHERE path=?", (st.st_mtime, st.st_size, name))
+                if row[3] != 'done': todo.append(name) # interrotto: si riprende dalle pagine mancanti
+                continue
+            legacy = None if row else conn.execute("SELECT id FROM knowledge_base WHERE source=?", (f"PDF:{name}",)).fetchone()
+            conn.execute("""INSERT INTO knowledge_files (path, mtime, size, sha256, status, pages_total, pages_done, doc_id, error)
+                            VALUES (?,?,?,?,?,NULL,0,?,NULL)
+                            ON CONFLICT(path) DO UPDATE SET mtime=excluded.mtime, size=excluded.size, sha256=excluded.sha256,
+                                status=excluded.status, pages_total=NULL, pages_done=0, error=NULL""",
+                         (name, st.st_mtime, st.st_size, digest, 'done' if legacy else 'pending', legacy[0] if legacy else None))
+            conn.execute("DELETE FROM knowledge_pages WHERE path=?", (name,))
+        if not legacy: todo.append(name)
+    return todo
+
+# --- 4. SCRITTURA ---
+def _finalize(conn, name):
+    # Documento completo: sostituisce la versione precedente solo ora e ne indicizza i passaggi
+    pages = [r[0] for r in conn.execute("SELECT content FROM knowledge_pages WHERE path=? ORDER BY page", (name,))]
+    old = conn.execute("SELECT doc_id FROM knowledge_files WHERE path=?", (name,)).fetchone()
+    if old and old[0]:
+        conn.execute("DELETE FROM knowledge_chunks WHERE doc_id=?", (old[0],))
+        conn.execute("DELETE FROM knowledge_base WHERE id=?", (old[0],))
+    txt = "\n".join(pages)
+    doc_id = conn.execute("INSERT INTO knowledge_base (source,content) VALUES (?,?)", (f"PDF:{name}", txt)).lastrowid
+    index_document(conn, doc_id, txt)
+    conn.execute("DELETE FROM knowledge_pages WHERE path=?", (name,))
+    conn.execute("UPDATE knowledge_files SET status='done', doc_id=?, error=NULL, updated_at=CURRENT_TIMESTAMP WHERE path=?", (doc_id, name))
+    bump_generation("kb") # passaggi KB cambiati: kb_fingerprint va ricalcolato (dopo il commit)
+    return doc_id
+
+def _fail(name, err):
+    with db_session() as conn:
+        conn.execute("UPDATE knowledge_files SET status='error', error=?, updated_at=CURRENT_TIMESTAMP WHERE path=?", (str(err)[:500], name))
+    with _job_lock:
+        _job["errors"].append((name, str(err)))
+        _job["files_done"] += 1
+
+# --- 5. JOB IN BACKGROUND ---
+def _run(folder, max_workers):
+    try:
+        todo = plan_files(folder)
+        with _job_lock: _job.update(files_total=len(todo), phase="estrazione")
+        if not todo: return
+        remaining, failed = {}, set()
+        with ProcessPoolExecutor(max_workers=min(len(todo), max_workers or os.cpu_count() or 1)) as pool:
+            pending = {pool.submit(count_pages, os.path.join(folder, n)): ("count", n) for n in todo}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    kind, name = pending.pop(fut)
+                    if name in failed: continue
+                    try: res = fut.result()
+                    except Exception as e:
+                        failed.add(name); _fail(name, e); continue
+
+                    if kind == "count":
+                        with db_session() as conn:
+                            have = {r[0] for r in conn.execute("SELECT page FROM knowledge_pages WHERE path=?", (name,))}
+                            conn.execute("UPDATE knowledge_files SET status='running', pages_total=?, pages_done=? WHERE path=?", (res, len(have), name))
+                        missing = [p for p in range(res) if p not in have]
+                        with _job_lock:
+                            _job["pages_total"] += res; _job["pages_done"] += len(have)
+                        batches = [missing[i:i + PAGE_BATCH] for i in range(0, len(missing), PAGE_BATCH)]
+                        remaining[name] = len(batches)
+                        for b in batches: pending[pool.submit(extract_pages, os.path.join(folder, name), b)] = ("pages", name)
+                    else:
+                        with db_session() as conn:
+                            conn.executemany("INSERT OR REPLACE INTO knowledge_pages (path, page, content) VALUES (?,?,?)", [(name, p, t) for p, t in res])
+                            conn.execute("UPDATE knowledge_files SET pages_done = pages_done + ? WHERE path=?", (len(res), name))
+                        remaining[name] -= 1
+                        with _job_lock: _job["pages_done"] += len(res)
+
+                    if remaining.get(name) == 0:
+                        try:
+                            with db_session() as conn: doc_id = _finalize(conn, name)
+                            # Embedding dopo il commit, fuori da ogni transazione: il documento è già cercabile via BM25
+                            embed_document(doc_id)
+                            with _job_lock: _job["files_done"] += 1
+                        except Exception as e:
+                            failed.add(name); _fail(name, e)
+    except Exception as e:
+        with _job_lock: _job["errors"].append(("job", str(e)))
+    finally:
+        with _job_lock: _job.update(running=False, phase="finito")
+        close_connections()
+
+def start_pdf_ingest(folder=PDF_FOLDER, max_workers=None):
+    """Avvia l'ingest in un thread di background. False se un job è già in corso."""
+    with _job_lock:
+        if _job["running"]: return False
+        _job.clear()
+        _job.update(running=True, phase="scansione", folder=folder, files_total=0, files_done=0, pages_total=0, pages_done=0, errors=[])
+    threading.Thread(target=_run, args=(folder, max_workers), daemon=True).start()
+    return True
+
+def pdf_ingest_status():
+    with _job_lock: return {**_job, "errors": list(_job.get("errors", []))}
+
+def get_file_status():
+    with db_session() as conn:
+        return conn.execute("SELECT path, status, pages_done, pages_total, error, updated_at FROM knowledge_files ORDER BY path").fetchall()
@@ -0,0 +1,101 @@
+import time
+import threading
+from collections import namedtuple
+from retrieval_logic import estimate_tokens
+from database import data_generation
+
+# --- 1. CONFIGURAZIONE ---
+# Finestra di contesto per modello (token) e quota riservata ai blocchi di contesto; il resto va alla chat
+MODEL_CONTEXT = {"mistral-nemo": 16384, "mistral": 8192, "llama3": 8192, "llama3.1": 16384, "qwen2.5": 16384}
+DEFAULT_CONTEXT = 4096
+CONTEXT_SHARE = 0.5
+# Ordine fisso dei blocchi nel system prompt: prefisso identico tra i turni = KV-cache di Ollama riusata.
+# La KB cambia a ogni domanda: sta in un messaggio a parte subito prima dell'ultimo messaggio utente.
+# La memoria (riassunto dei turni vecchi) cambia solo quando si riassume: ultima del prefisso stabile.
+BLOCK_ORDER = ["ruolo", "ads", "spotify", "social", "memoria"]
+VOLATILE_BLOCK = "kb"
+# Se si sfora il budget si accorcia in quest'ordine (il ruolo non si tocca mai)
+TRIM_ORDER = ["spotify", "social", "kb", "memoria", "ads"]
+SPOTIFY_TTL = 600
+
+ROLE_TEXT = """SEI UN MANAGER DI ETICHETTA DISCOGRAFICA (Data-Driven).
+OBIETTIVO:
+Analizza se la crescita social (TREND SOCIAL) giustifica la spesa ads (DATI ADS).
+Sii critico e usa i dati."""
+
+Block = namedtuple("Block", "name version text tokens")
+
+# --- 2. BLOCCHI VERSIONATI ---
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+def context_block(name, version, build):
+    """Blocco di contesto ricostruito solo quando cambia la versione (build() -> testo)."""
+    with _blocks_lock:
+        hit = _blocks.get(name)
+        if hit and hit.version == version: return hit
+    text = (build() or "").strip()
+    block = Block(name, version, text, estimate_tokens(text) if text else 0)
+    with _blocks_lock: _blocks[name] = block
+    return block
+
+def ttl_version(seconds):
+    # Versione a scadenza per fonti esterne senza contatore (API)
+    return int(time.time() // seconds)
+
+def role_block():
+    return context_block("ruolo", ROLE_TEXT, lambda: ROLE_TEXT)
+
+def ads_block():
+    def build():
+        from campaign_logic import get_campaigns
+        c = get_campaigns()
+        sp = c['spend'].sum() if not c.empty else 0
+        rv = c['revenue'].sum() if not c.empty else 0
+        return f"DATI ADS:\n- Ads Spend: €{sp}, Revenue: €{rv}"
+    return context_block("ads", data_generation(), build)
+
+def spotify_block(fetch=None):
+    """fetch() restituisce il testo Spotify; chiamato al massimo una volta ogni SPOTIFY_TTL secondi."""
+    if fetch is None: return context_block("spotify", None, lambda: "")
+    return context_block("spotify", ttl_version(SPOTIFY_TTL), lambda: f"DATI SPOTIFY:\n{fetch()}")
+
+def text_block(name, text, title):
+    # Testo già calcolato dal chiamante (contesto social, KB): versione = testo stesso
+    return context_block(name, text, lambda: f"{title}:\n{text}" if text else "")
+
+# --- 3. ASSEMBLAGGIO ---
+def budget_for(model):
+    return int(MODEL_CONTEXT.get(model, DEFAULT_CONTEXT) * CONTEXT_SHARE)
+
+def _trim(text, tokens):
+    if tokens <= 0: return ""
+    if estimate_tokens(text) <= tokens: return text
+    cut = text[:tokens * 4]
+    nl = cut.rfind("\n")
+    return (cut[:nl] if nl > len(cut) // 2 else cut) + "\n…" # a fine riga se non si perde troppo
+
+def fit_blocks(blocks, budget):
+    """{nome: testo} entro il budget: si accorciano i blocchi in TRIM_ORDER, in modo deterministico."""
+    texts = {b.name: b.text for b in blocks if b.text}
+    over = sum(estimate_tokens(t) for t in texts.values()) - budget
+    for name in TRIM_ORDER:
+        if over <= 0: break
+        if name not in texts: continue
+        cur = estimate_tokens(texts[name])
+        texts[name] = _trim(texts[name], cur - over)
+        over -= cur - (estimate_tokens(texts[name]) if texts[name] else 0)
+        if not texts[name]: del texts[name]
+    return texts
+
+def build_messages(history, blocks, model):
+    """
+    Messaggi per Ollama: system prompt stabile (BLOCK_ORDER) + storico + contesto volatile + ultimo messaggio.
+    Ritorna (messages, token stimati del contesto).
+    """
+    texts = fit_blocks(blocks, budget_for(model))
+    system = "\n\n".join(texts[n] for n in BLOCK_ORDER if n in texts)
+    msgs = [{'role': 'system', 'content': system}] + list(history[:-1])
+    if VOLATILE_BLOCK in texts: msgs.append({'role': 'system', 'content': texts[VOLATILE_BLOCK]})
+    msgs += list(history[-1:])
+    return msgs, sum(estimate_tokens(t) for t in texts.values())
@@ -0,0 +1,110 @@
+import re
+from database import db_session
+from embedding_logic import content_hash, embed_missing, semantic_search
+
+# --- 1. CONFIGURAZIONE ---
+CHUNK_TOKENS = 220      # dimensione passaggio (token stimati)
+CHUNK_OVERLAP = 40      # token ripetuti tra passaggi consecutivi
+TOP_K = 6
+TOKEN_BUDGET = 1500     # tetto del contesto KB nel prompt
+RRF_K = 60              # costante della reciprocal rank fusion (BM25 + vettori)
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+SENTENCE_RE = re.compile(r'(?<=[.!?])\s+|\n{2,}')
+
+def estimate_tokens(text):
+    # Stima grezza (≈4 caratteri per token): basta per i budget, niente tokenizer esterno
+    return max(1, len(text or "") // 4)
+
+# --- 2. CHUNKING (INGEST) ---
+def chunk_text(text, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    """Divide un documento in passaggi di circa max_tokens, spezzando sulle frasi quando possibile."""
+    text = re.sub(r'[ \t]+', ' ', text or "").strip()
+    if not text: return []
+    # Si lavora in caratteri (stessa scala di estimate_tokens), spazi di giunzione inclusi
+    max_chars, overlap_chars = max_tokens * 4, overlap * 4
+    chunks, cur, cur_len = [], [], 0
+    for sent in SENTENCE_RE.split(text):
+        sent = sent.strip()
+        if not sent: continue
+        # Frase più lunga di un passaggio: taglio a parole
+        while len(sent) > max_chars:
+            cut = sent.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            head, sent = sent[:cut], sent[cut:].strip()
+            if cur: chunks.append(" ".join(cur)); cur, cur_len = [], 0
+            chunks.append(head)
+        if cur and cur_len + 1 + len(sent) > max_chars:
+            chunks.append(" ".join(cur))
+            # Sovrapposizione: le ultime frasi del passaggio precedente aprono il successivo
+            keep, keep_len = [], 0
+            for x in reversed(cur):
+                keep_len += len(x) + 1
+                if keep_len > overlap_chars: break
+                keep.insert(0, x)
+            cur, cur_len = keep, max(0, sum(len(x) + 1 for x in keep) - 1)
+        cur_len += len(sent) + (1 if cur else 0)
+        cur.append(sent)
+    if cur: chunks.append(" ".join(cur))
+    return chunks
+
+def index_document(conn, doc_id, content):
+    """(Ri)scrive i passaggi di un documento; l'indice FTS si aggiorna via trigger."""
+    conn.execute("DELETE FROM knowledge_chunks WHERE doc_id=?", (doc_id,))
+    rows = [(doc_id, i, c, estimate_tokens(c), content_hash(c)) for i, c in enumerate(chunk_text(content))]
+    conn.executemany("INSERT INTO knowledge_chunks (doc_id, seq, content, tokens, content_hash) VALUES (?,?,?,?,?)", rows)
+    return len(rows)
+
+def embed_document(doc_id):
+    # Embedding solo per i passaggi nuovi, dopo il commit del documento: senza Ollama resta cercabile via BM25
+    try: return embed_missing(doc_id=doc_id)
+    except Exception: return 0
+
+def reindex_missing(conn):
+    # Documenti senza passaggi (migrazione / righe scritte da codice vecchio)
+    docs = conn.execute("""SELECT id, content FROM knowledge_base
+                           WHERE id NOT IN (SELECT DISTINCT doc_id FROM knowledge_chunks)""").fetchall()
+    for doc_id, content in docs: index_document(conn, doc_id, content)
+    return len(docs)
+
+# --- 3. RICERCA ---
+def fts_query(text):
+    # Termini tra virgolette in OR: nessun carattere dell'utente viene letto come sintassi FTS5
+    terms = list(dict.fromkeys(w for w in WORD_RE.findall((text or "").lower()) if len(w) > 2))
+    return " OR ".join(f'"{w}"' for w in terms[:32])
+
+def search_passages(query, k=TOP_K):
+    """Top-k passaggi per BM25: lista di (chunk_id, source, content, tokens, score); score più basso = migliore."""
+    q = fts_query(query)
+    if not q: return []
+    with db_session() as conn:
+        return conn.execute("""SELECT c.id, kb.source, c.content, c.tokens, bm25(knowledge_fts) AS score
+                               FROM knowledge_fts
+                               JOIN knowledge_chunks c ON c.id = knowledge_fts.rowid
+                               JOIN knowledge_base kb ON kb.id = c.doc_id
+                               WHERE knowledge_fts MATCH ? ORDER BY score LIMIT ?""", (q, k)).fetchall()
+
+def pack_context(passages, token_budget=TOKEN_BUDGET):
+    """Passaggi in ordine di rilevanza finché stanno nel budget di token."""
+    out, used = [], 0
+    for _, source, content, tokens, _ in passages:
+        if used + tokens > token_budget: continue
+        out.append(f"-- {source} --\n{content}")
+        used += tokens
+    return "\n".join(out)
+
+def hybrid_search(query, k=TOP_K):
+    """
+    BM25 + similarità coseno fuse per posizione (reciprocal rank fusion).
+    Se l'embedder non risponde resta solo BM25. Stesso formato di search_passages; score più basso = migliore.
+    """
+    lexical = search_passages(query, k * 2)
+    try: semantic = semantic_search(query, k * 2)
+    except Exception: semantic = []
+    if not semantic: return lexical[:k]
+    fused, rows = {}, {}
+    for results in (lexical, semantic):
+        for rank, r in enumerate(results):
+            fused[r[0]] = fused.get(r[0], 0) + 1 / (RRF_K + rank + 1)
+            rows.setdefault(r[0], r)
+    best = sorted(fused, key=fused.get, reverse=True)[:k]
+    return [(*rows[i][:4], -fused[i]) for i in best]
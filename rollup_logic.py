@@ -0,0 +1,125 @@
+import json
+import pandas as pd
+from datetime import date, timedelta
+from database import db_session, cached_read
+from analytics_logic import audience_latest, audience_pivot
+
+# --- 1. CONFIGURAZIONE ---
+# Chiave del periodo per ogni granularità (Settimana = lunedì, Mese = primo del mese)
+GRAINS = {
+    "D": "date_recorded",
+    "W": "date(date_recorded, '-6 days', 'weekday 1')",
+    "M": "strftime('%Y-%m-01', date_recorded)",
+}
+# Rollup e tabella demografica hanno chiavi intere (platform_id, metric_id) come stats_facts;
+# le metriche demografiche (metrics.kind = 'audience') vivono in audience_stats, non nelle serie temporali
+
+def _period_bounds(grain, d):
+    # Primo e ultimo giorno del periodo che contiene d
+    if grain == "W":
+        start = d - timedelta(days=d.weekday())
+        return start, start + timedelta(days=6)
+    if grain == "M":
+        start = d.replace(day=1)
+        nxt = (start + timedelta(days=32)).replace(day=1)
+        return start, nxt - timedelta(days=1)
+    return d, d
+
+# --- 2. AGGIORNAMENTO (INGEST) ---
+def _rollup_sql(expr, where):
+    # MAX(date_recorded) è l'unico min/max: SQLite prende 'value' dalla riga più recente del periodo.
+    # Le date non ISO salvate dal vecchio parser (es. "da") danno un periodo NULL: restano fuori dai rollup
+    return f"""INSERT INTO stats_rollup (grain, platform_id, metric_id, period, value_sum, value_avg, value_last, n)
+               SELECT g, platform_id, metric_id, period, s, a, last, n FROM (
+                   SELECT ? AS g, f.platform_id, f.metric_id, {expr} AS period, SUM(f.value) AS s, AVG(f.value) AS a,
+                          COUNT(*) AS n, MAX(f.date_recorded), f.value AS last
+                   FROM stats_facts f JOIN metrics m ON m.id = f.metric_id
+                   WHERE date(f.date_recorded) IS NOT NULL AND m.kind <> 'audience' AND {where}
+                   GROUP BY f.platform_id, f.metric_id, period)"""
+
+def _rebuild_range(conn, grain, platform_id, metric_id, lo, hi):
+    expr = GRAINS[grain]
+    conn.execute("DELETE FROM stats_rollup WHERE grain=? AND platform_id=? AND metric_id=? AND period BETWEEN ? AND ?",
+                 (grain, platform_id, metric_id, lo.isoformat(), hi.isoformat()))
+    conn.execute(_rollup_sql(expr, "f.platform_id=? AND f.metric_id=? AND f.date_recorded BETWEEN ? AND ?"),
+                 (grain, platform_id, metric_id, lo.isoformat(), hi.isoformat()))
+
+def refresh_rollups(conn, stat_rows):
+    """
+    Aggiorna in modo incrementale rollup e tabella demografica per le righe appena scritte
+    (dimensioni già registrate da ensure_dimensions): si ricalcolano solo i periodi toccati di ogni (piattaforma, metrica).
+    """
+    if not stat_rows: return
+    pid = dict(conn.execute("SELECT name, id FROM platforms WHERE name IN (SELECT value FROM json_each(?))",
+                            (json.dumps(sorted({r[0] for r in stat_rows})),)))
+    mid = {n: (i, k) for n, i, k in conn.execute("SELECT name, id, kind FROM metrics WHERE name IN (SELECT value FROM json_each(?))",
+                                                  (json.dumps(sorted({r[1] for r in stat_rows})),))}
+    spans, audience = {}, []
+    for platform, metric, d, value in stat_rows:
+        try: day = date.fromisoformat(d)
+        except: continue  # data non ISO: niente periodo, come in _rollup_sql
+        key, kind = (pid[platform], mid[metric][0]), mid[metric][1]
+        if kind == "audience":
+            audience.append((*key, d, value))
+            continue
+        lo, hi = spans.get(key, (day, day))
+        spans[key] = (min(lo, day), max(hi, day))
+
+    for (platform_id, metric_id), (lo, hi) in spans.items():
+        for grain in GRAINS:
+            start, _ = _period_bounds(grain, lo)
+            _, end = _period_bounds(grain, hi)
+            _rebuild_range(conn, grain, platform_id, metric_id, start, end)
+
+    conn.executemany("""INSERT INTO audience_stats (platform_id, metric_id, date_recorded, value) VALUES (?,?,?,?)
+                        ON CONFLICT(platform_id, metric_id, date_recorded) DO UPDATE SET value=excluded.value""", audience)
+
+def rebuild_rollups(conn):
+    # Ricostruzione completa (migrazione iniziale, benchmark)
+    conn.execute("DELETE FROM stats_rollup")
+    for grain, expr in GRAINS.items():
+        conn.execute(_rollup_sql(expr, "1"), (grain,))
+    conn.execute("DELETE FROM audience_stats")
+    conn.execute("""INSERT INTO audience_stats (platform_id, metric_id, date_recorded, value)
+                    SELECT f.platform_id, f.metric_id, f.date_recorded, f.value
+                    FROM stats_facts f JOIN metrics m ON m.id = f.metric_id
+                    WHERE m.kind = 'audience' AND date(f.date_recorded) IS NOT NULL""")
+
+# --- 3. LETTURA (DASHBOARD) ---
+@cached_read()
+def get_trend_metrics(platforms):
+    if not platforms: return []
+    with db_session() as conn:
+        rows = conn.execute("""SELECT DISTINCT m.name FROM stats_rollup r
+                               JOIN platforms p ON p.id = r.platform_id JOIN metrics m ON m.id = r.metric_id
+                               WHERE r.grain='M' AND p.name IN (SELECT value FROM json_each(?)) ORDER BY m.name""",
+                            (json.dumps(list(platforms)),)).fetchall()
+    return [r[0] for r in rows]
+
+@cached_read()
+def get_trend(platforms, metrics, grain="D", date_from=None, date_to=None):
+    """
+    Punti pre-aggregati: date_recorded (inizio periodo), platform, metric_type, value_sum, value_avg, value_last.
+    date_from/date_to (inclusi) selezionano i periodi che toccano l'intervallo.
+    """
+    if not platforms or not metrics: return pd.DataFrame()
+    lo = _period_bounds(grain, date.fromisoformat(str(date_from)))[0].isoformat() if date_from else "0000-01-01"
+    hi = str(date_to) if date_to else "9999-12-31"
+    with db_session() as conn:
+        df = pd.read_sql_query("""SELECT r.period AS date_recorded, p.name AS platform, m.name AS metric_type, r.value_sum, r.value_avg, r.value_last, r.n
+                                  FROM stats_rollup r JOIN platforms p ON p.id = r.platform_id JOIN metrics m ON m.id = r.metric_id
+                                  WHERE r.grain=? AND p.name IN (SELECT value FROM json_each(?))
+                                  AND m.name IN (SELECT value FROM json_each(?)) AND r.period BETWEEN ? AND ? ORDER BY r.period""",
+                               conn, params=(grain, json.dumps(list(platforms)), json.dumps(list(metrics)), lo, hi))
+    df['date_recorded'] = pd.to_datetime(df['date_recorded'])
+    return df
+
+@cached_read()
+def get_audience_latest(platforms):
+    """Ultima fotografia demografica (data più recente tra le piattaforme scelte)."""
+    if not platforms: return pd.DataFrame()
+    return audience_latest(platforms)
+
+@cached_read()
+def get_audience_pivot(platforms):
+    return audience_pivot(platforms)
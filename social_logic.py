@@ -1,8 +1,15 @@
 import pandas as pd
 import io
 import re
-from datetime import datetime
-from database import get_connection
+import codecs
+import hashlib
+import json
+import numpy as np
+from datetime import datetime, date
+from functools import lru_cache
+from database import db_session, cached_read, bump_generation
+from rollup_logic import refresh_rollups
+from dimension_logic import ensure_dimensions
 
 # --- 1. CONFIGURAZIONE ---
 DATE_MAP = {
@@ -13,85 +20,230 @@ DATE_MAP = {
     "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
     "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
 }
-CURRENT_YEAR = datetime.now().year
+CURRENT_YEAR = datetime.now().year  # solo riferimento: la regola di rollover è in rollover_year()
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d', '%d.%m.%Y']
+TEXT_DATE_RE = re.compile(r'(\d{1,2})\s+([a-z]+)')
+
+# Loader CSV
+CSV_ENCODINGS = ['utf-8', 'utf-16', 'latin-1', 'cp1252']
+SNIFF_BYTES = 64 * 1024
+CSV_CHUNKSIZE = 50000
+_MISSING = object()
+
+# Snapshot contenuti: storico su idx_posts_perf_key, ultimo valore in posts_latest
+UPSERT_PERF_SQL = """
+    INSERT INTO posts_performance (post_id, date_recorded, views, likes, comments, shares) VALUES (?,?,?,?,?,?)
+    ON CONFLICT(post_id, date_recorded) DO UPDATE SET views=excluded.views, likes=excluded.likes, comments=excluded.comments, shares=excluded.shares
+"""
+UPSERT_LATEST_SQL = """
+    INSERT INTO posts_latest (post_id, date_recorded, views, likes, comments, shares) VALUES (?,?,?,?,?,?)
+    ON CONFLICT(post_id) DO UPDATE SET date_recorded=excluded.date_recorded, views=excluded.views, likes=excluded.likes, comments=excluded.comments, shares=excluded.shares
+    WHERE excluded.date_recorded >= posts_latest.date_recorded
+"""
+
+HEADER_KEYWORDS = ["date", "time", "giorno", "data", "gender", "territories", "video title", "post time", "impression", "reach", "primary", "età", "nome dell'inserzione", "uomini", "donne"]
+
+# UPSERT sulla chiave unica di stats_facts (social_stats è la vista con i nomi, vedi init_advanced_db);
+# le righe invariate non vengono riscritte. Piattaforma e metrica vanno registrate prima (ensure_dimensions).
+UPSERT_STAT_SQL = """
+    INSERT INTO stats_facts (platform_id, metric_id, date_recorded, value, source_type)
+    VALUES ((SELECT id FROM platforms WHERE name=?), (SELECT id FROM metrics WHERE name=?), ?, ?, 'csv_gen')
+    ON CONFLICT(platform_id, metric_id, date_recorded) DO UPDATE SET value=excluded.value, source_type=excluded.source_type
+    WHERE stats_facts.value IS NOT excluded.value OR stats_facts.source_type IS NOT excluded.source_type
+"""
 
 # --- 2. LETTURA DATI ---
+@cached_read(fallback=lambda: (None, pd.DataFrame()))
 def get_data_health():
-    conn = get_connection()
-    try:
+    """(ultima data registrata, riepilogo per piattaforma/metrica con righe e intervallo date)."""
+    with db_session() as conn:
         last = conn.execute("SELECT MAX(date_recorded) FROM social_stats").fetchone()
         last_str = last[0] if last else None
-        # Recupera tutto per i filtri globali
-        query = "SELECT date_recorded, platform, metric_type, value FROM social_stats ORDER BY date_recorded DESC LIMIT 10000"
+        query = """SELECT platform, metric_type, COUNT(*) AS rows, MIN(date_recorded) AS first, MAX(date_recorded) AS last
+                   FROM social_stats GROUP BY platform, metric_type"""
         return last_str, pd.read_sql_query(query, conn)
-    except: return None, pd.DataFrame()
-    finally: conn.close()
 
+def _stats_where(platforms, metrics=None, date_from=None, date_to=None):
+    # Filtri della sidebar tradotti in SQL (liste passate come JSON, un solo parametro)
+    where, params = ["platform IN (SELECT value FROM json_each(?))"], [json.dumps(list(platforms))]
+    if metrics:
+        where.append("metric_type IN (SELECT value FROM json_each(?))"); params.append(json.dumps(list(metrics)))
+    if date_from:
+        where.append("date_recorded >= ?"); params.append(str(date_from))
+    if date_to:
+        where.append("date_recorded <= ?"); params.append(str(date_to))
+    return " AND ".join(where), params
+
+@cached_read()
+def query_stats(platforms, metrics=None, date_from=None, date_to=None, limit=1000, offset=0):
+    """
+    Una pagina di social_stats (più recenti prima) filtrata lato SQL.
+    platforms/metrics sono tuple; metrics vuoto = tutte. date_from/date_to inclusi (ISO o date).
+    """
+    if not platforms: return pd.DataFrame()
+    where, params = _stats_where(platforms, metrics, date_from, date_to)
+    with db_session() as conn:
+        df = pd.read_sql_query(f"""SELECT date_recorded, platform, metric_type, value FROM social_stats WHERE {where}
+                                   ORDER BY date_recorded DESC, platform, metric_type LIMIT ? OFFSET ?""",
+                               conn, params=params + [int(limit), int(offset)])
+    df['date_recorded'] = pd.to_datetime(df['date_recorded'], errors='coerce')
+    return df
+
+@cached_read()
+def count_stats(platforms, metrics=None, date_from=None, date_to=None):
+    if not platforms: return 0
+    where, params = _stats_where(platforms, metrics, date_from, date_to)
+    with db_session() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM social_stats WHERE {where}", params).fetchone()[0]
+
+@cached_read()
+def get_platforms():
+    """Piattaforme presenti tra statistiche (tabella platforms) e contenuti, senza caricare righe."""
+    with db_session() as conn:
+        rows = conn.execute("SELECT name FROM platforms UNION SELECT DISTINCT platform FROM posts_inventory").fetchall()
+    return sorted(r[0] for r in rows if r[0])
+
+@cached_read()
+def get_metric_names(platforms):
+    if not platforms: return []
+    with db_session() as conn:
+        rows = conn.execute("SELECT DISTINCT metric_type FROM social_stats WHERE platform IN (SELECT value FROM json_each(?)) ORDER BY metric_type",
+                            (json.dumps(list(platforms)),)).fetchall()
+    return [r[0] for r in rows]
+
+@cached_read()
+def get_date_bounds():
+    with db_session() as conn:
+        return conn.execute("SELECT MIN(date_recorded), MAX(date_recorded) FROM social_stats").fetchone()
+
+@cached_read(fallback=pd.DataFrame)
 def get_content_health():
-    conn = get_connection()
-    try:
+    with db_session() as conn:
+        # posts_latest è tenuta aggiornata in ingest: costo indipendente dallo storico snapshot
         q = """
         SELECT i.post_id, i.platform, i.date_published, i.caption, 
                p.views, p.likes, p.comments, p.shares, p.date_recorded
         FROM posts_inventory i
-        JOIN posts_performance p ON i.post_id = p.post_id
-        WHERE p.date_recorded = (SELECT MAX(date_recorded) FROM posts_performance WHERE post_id = i.post_id)
+        JOIN posts_latest p ON i.post_id = p.post_id
         ORDER BY p.views DESC
         """
         return pd.read_sql_query(q, conn)
-    except: return pd.DataFrame()
-    finally: conn.close()
 
+def reset_social_data():
+    with db_session() as conn:
+        for t in ["stats_facts", "metrics", "platforms", "upload_logs", "posts_inventory", "posts_performance", "posts_latest", "stats_rollup", "audience_stats"]:
+            conn.execute(f"DELETE FROM {t}")
+    bump_generation()
+
+@cached_read(fallback=pd.DataFrame)
 def get_file_upload_history():
-    conn = get_connection()
-    try: return pd.read_sql_query("SELECT upload_date, filename, platform, status FROM upload_logs ORDER BY id DESC LIMIT 50", conn)
-    except: return pd.DataFrame()
-    finally: conn.close()
+    with db_session() as conn:
+        return pd.read_sql_query("SELECT upload_date, filename, platform, status FROM upload_logs ORDER BY id DESC LIMIT 50", conn)
+
+def file_fingerprint(uploaded_file, block_size=1024 * 1024):
+    # SHA-256 in streaming: il file non viene mai copiato per intero in memoria
+    h = hashlib.sha256()
+    uploaded_file.seek(0)
+    for block in iter(lambda: uploaded_file.read(block_size), b''): h.update(block)
+    uploaded_file.seek(0)
+    return h.hexdigest()
 
-def check_file_log(filename, platform):
-    conn = get_connection()
+def check_file_log(file_hash, platform):
+    # Salta solo i file identici byte per byte già caricati con successo (lookup su idx_upload_logs_hash)
     try:
-        res = conn.execute("SELECT upload_date FROM upload_logs WHERE filename=? AND platform=? AND status LIKE '%OK%' ORDER BY id DESC LIMIT 1", (filename, platform)).fetchone()
-        return (True, res[0]) if res else (False, None)
+        with db_session() as conn:
+            res = conn.execute("SELECT upload_date FROM upload_logs WHERE file_hash=? AND platform=? AND status LIKE 'OK%' ORDER BY id DESC LIMIT 1", (file_hash, platform)).fetchone()
+            return (True, res[0]) if res else (False, None)
     except: return False, None
-    finally: conn.close()
 
-def log_upload_event(filename, platform, status):
-    conn = get_connection()
+def find_overlapping_upload(conn, platform, date_min, date_max):
+    if not date_min: return None
+    res = conn.execute("""SELECT filename FROM upload_logs
+                          WHERE platform=? AND date_max >= ? AND date_min <= ? AND status LIKE 'OK%'
+                          ORDER BY id DESC LIMIT 1""", (platform, date_min, date_max)).fetchone()
+    return res[0] if res else None
+
+def log_upload_event(filename, platform, status, file_hash=None, row_count=None, date_min=None, date_max=None):
     try:
-        conn.execute("INSERT INTO upload_logs (filename, platform, status) VALUES (?, ?, ?)", (filename, platform, status))
-        conn.commit()
+        with db_session() as conn:
+            conn.execute("INSERT INTO upload_logs (filename, platform, status, file_hash, row_count, date_min, date_max) VALUES (?,?,?,?,?,?,?)",
+                         (filename, platform, status, file_hash, row_count, date_min, date_max))
+        bump_generation()
     except: pass
-    finally: conn.close()
 
 # --- 4. PARSING ---
-def parse_smart_date(date_str):
-    if not isinstance(date_str, str): return None
-    s = date_str.strip().lower()
-    
+def rollover_year(month, today=None):
+    """
+    Anno da assegnare alle date testuali senza anno (TikTok "12 gen").
+    Nei primi mesi dell'anno (gen-mag) i mesi da settembre in poi sono dell'anno precedente.
+    """
+    today = today or date.today()
+    return today.year - 1 if today.month < 6 and month > 8 else today.year
+
+@lru_cache(maxsize=None)
+def _month_from_text(m_str):
+    return next((v for k,v in DATE_MAP.items() if k in m_str), None)
+
+@lru_cache(maxsize=4096)
+def _parse_date_cached(s, today):
     # ISO (IG) - Gestione T
-    if 't' in s and '-' in s:
-        try: return s.split('t')[0]
-        except: pass
-    
-    # Testuale (TikTok)
-    s_clean = s.split('t')[0]
-    match = re.search(r'(\d{1,2})\s+([a-z]+)', s_clean)
+    if 't' in s and '-' in s: return s.split('t')[0]
+
+    # Testuale (TikTok) - sulla stringa intera, altrimenti "ott"/"set" verrebbero troncati dallo split su 't'
+    match = TEXT_DATE_RE.search(s)
     if match:
-        d, m_str = int(match.group(1)), match.group(2)
-        m = next((v for k,v in DATE_MAP.items() if k in m_str), None)
+        d, m = int(match.group(1)), _month_from_text(match.group(2))
         if m:
-            y = CURRENT_YEAR
-            if datetime.now().month < 6 and m > 8: y -= 1
-            try: return datetime(y, m, d).strftime('%Y-%m-%d')
+            try: return date(rollover_year(m, today), m, d).strftime('%Y-%m-%d')
             except: pass
-            
+
     # Standard
-    for fmt in ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d', '%d.%m.%Y']:
+    s_clean = s.split('t')[0]
+    for fmt in DATE_FORMATS:
         try: return datetime.strptime(s_clean, fmt).strftime('%Y-%m-%d')
         except: continue
     return None
 
+def parse_smart_date(date_str, today=None):
+    if not isinstance(date_str, str): return None
+    return _parse_date_cached(date_str.strip().lower(), today or date.today())
+
+def detect_date_format(sample):
+    # I formati standard sono mutuamente esclusivi: vale il primo che interpreta tutto il campione
+    sample = pd.Series([x for x in sample if x], dtype=object)
+    if sample.empty: return None
+    for fmt in DATE_FORMATS:
+        if pd.to_datetime(sample, format=fmt, errors='coerce').notna().all(): return fmt
+    return None
+
+def parse_date_column(series, today=None, sample_size=50):
+    """
+    Versione colonnare di parse_smart_date: rileva il formato da un campione e converte
+    la colonna in blocco con pd.to_datetime; il resto passa dal parser scalare (memoizzato).
+    """
+    today = today or date.today()
+    s = series.astype(object).map(str).str.strip().str.lower().reset_index(drop=True)
+    out = np.full(len(s), None, dtype=object)
+
+    iso = (s.str.contains('t', regex=False) & s.str.contains('-', regex=False)).to_numpy()
+    out[iso] = s[iso].str.split('t').str[0].to_numpy()
+
+    pending = ~iso
+    std = pending & ~s.str.contains(r'\d\s+[a-z]').to_numpy()  # esclude le testuali
+    s_clean = s[std].str.split('t').str[0]
+    fmt = detect_date_format(s_clean.drop_duplicates().head(sample_size).tolist())
+    if fmt:
+        parsed = pd.to_datetime(s_clean, format=fmt, errors='coerce')
+        ok = parsed.notna()
+        out[ok.index[ok]] = parsed[ok].dt.strftime('%Y-%m-%d').to_numpy()
+        pending[ok.index[ok]] = False
+
+    rest = s[pending]
+    if not rest.empty:
+        memo = {u: _parse_date_cached(u, today) for u in rest.unique()}
+        out[pending] = [memo[u] for u in rest.tolist()]
+    return out.tolist()
+
 def clean_number(raw_val):
     s = str(raw_val).lower().strip()
     if not s or s in ['nan', 'none', '']: return 0
@@ -108,47 +260,111 @@ def clean_number(raw_val):
     try: return int(float(s) * mult)
     except: return 0
 
-# --- 5. SMART LOADER (AGGIORNATO) ---
-def smart_csv_loader(uploaded_file):
+def clean_number_series(series):
+    """
+    Versione vettoriale di clean_number (stesse regole per "1,2k", "3.456", "2M").
+    Ritorna (valori int64, maschera delle celle non interpretabili); le celle vuote valgono 0.
+    """
+    s = series.astype(object).map(str).str.lower().str.strip()
+    empty = s.isin(['', 'nan', 'none']).to_numpy()
+    mult = np.where(s.str.contains('m', regex=False), 1000000.0, np.where(s.str.contains('k', regex=False), 1000.0, 1.0))
+
+    s = s.str.replace('k', '', regex=False).str.replace('m', '', regex=False).str.strip()
+    # Logica euristica: se c'è punto e 3 cifre finali, è migliaia.
+    s = s.mask(s.str.contains(r'\.\d{3}$'), s.str.replace('.', '', regex=False))
+    s = s.str.replace(',', '.', regex=False).str.replace(r'[^\d\.]', '', regex=True)
+
+    # Solo le stringhe che float() accetterebbe; astype(float) arrotonda come float()
+    valid = s.str.fullmatch(r'\d+\.?\d*|\.\d+').to_numpy(dtype=bool)
+    num = np.zeros(len(s))
+    num[valid] = s[valid].to_numpy(dtype=str).astype(float)
+    vals = np.trunc(num * mult).astype(np.int64)
+    vals[empty] = 0
+    return vals, ~valid & ~empty
+
+# --- 5. SMART LOADER (STREAMING) ---
+def sniff_csv(head):
+    """Rileva (encoding, separatore, riga header) dai soli primi KB del file."""
+    text, enc = None, None
+    for e in CSV_ENCODINGS:
+        # Decoder incrementale: un carattere multibyte tagliato a fine blocco non è un errore
+        try: text = codecs.getincrementaldecoder(e)().decode(head, final=False); enc = e; break
+        except: continue
+    if not text: return None
+
+    lines = text.splitlines()
+    if len(head) >= SNIFF_BYTES and len(lines) > 1: lines = lines[:-1] # Ultima riga forse troncata
+
+    # 1. Rileva Separatore (scansiona prime righe)
+    sep = ','
+    comma_cnt = sum(l.count(',') for l in lines[:5])
+    semi_cnt = sum(l.count(';') for l in lines[:5])
+    if semi_cnt > comma_cnt: sep = ';'
+
+    # 2. Header Hunting Aggressivo
+    header_idx = 0 # Fallback
+    for i, line in enumerate(lines[:50]):
+        l_low = line.lower()
+        # Deve contenere una keyword E il separatore (per evitare titoli)
+        if any(k in l_low for k in HEADER_KEYWORDS) and sep in line:
+            header_idx = i
+            break
+    return enc, sep, header_idx
+
+def _clean_chunk(df):
+    df.columns = [str(c).strip() for c in df.columns]
+    df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
+    return df.dropna(how='all')
+
+def _iter_chunks(reader, text_io):
+    try:
+        for chunk in reader: yield _clean_chunk(chunk)
+    finally:
+        reader.close()
+        text_io.detach() # Non chiudere il file caricato sottostante
+
+def _decodes(f, enc):
+    # Decodifica stretta dell'intero file a blocchi (memoria costante): nessun carattere sostituito
+    dec = codecs.getincrementaldecoder(enc)()
+    f.seek(0)
     try:
-        bytes_data = uploaded_file.getvalue()
-        content = None
-        for enc in ['utf-8', 'utf-16', 'latin-1', 'cp1252']:
-            try: content = bytes_data.decode(enc); break
-            except: continue
-        if not content: return None, "Encoding Error"
-
-        lines = content.splitlines()
-        
-        # 1. Rileva Separatore (scansiona prime righe)
-        sep = ','
-        comma_cnt = sum(l.count(',') for l in lines[:5])
-        semi_cnt = sum(l.count(';') for l in lines[:5])
-        if semi_cnt > comma_cnt: sep = ';'
-        
-        # 2. Header Hunting Aggressivo
-        header_idx = 0
-        found = False
-        keywords = ["date", "time", "giorno", "data", "gender", "territories", "video title", "post time", "impression", "reach", "primary", "età", "nome dell'inserzione", "uomini", "donne"]
-        
-        for i, line in enumerate(lines[:50]):
-            l_low = line.lower()
-            # Deve contenere una keyword E il separatore (per evitare titoli)
-            if any(k in l_low for k in keywords) and sep in line:
-                header_idx = i
-                found = True
-                break
-        
-        if not found: header_idx = 0 # Fallback
-
-        data_io = io.StringIO(content)
+        for block in iter(lambda: f.read(SNIFF_BYTES), b""): dec.decode(block)
+        dec.decode(b"", final=True)
+        return True
+    except UnicodeError: return False
+
+def pick_encoding(f, first):
+    """L'encoding dello sniffing vale solo per i primi KB: si verifica sul file intero, poi i candidati successivi."""
+    cands = [first] + [e for e in CSV_ENCODINGS[CSV_ENCODINGS.index(first) + 1:] if e != first] if first in CSV_ENCODINGS else [first]
+    return next((e for e in cands if _decodes(f, e)), None)
+
+def stream_csv_chunks(uploaded_file, chunksize=CSV_CHUNKSIZE):
+    """
+    Legge l'export a blocchi: sniffing sui primi SNIFF_BYTES, poi pd.read_csv(chunksize=...)
+    direttamente sul file. Ritorna (iteratore di DataFrame, msg) con memoria costante.
+    """
+    try:
+        uploaded_file.seek(0)
+        sniff = sniff_csv(uploaded_file.read(SNIFF_BYTES))
+        if not sniff: return None, "Encoding Error"
+        enc, sep, header_idx = sniff
+        enc = pick_encoding(uploaded_file, enc)
+        if not enc: return None, "Encoding Error"
+
+        uploaded_file.seek(0)
+        text_io = io.TextIOWrapper(uploaded_file, encoding=enc, errors='strict', newline='')
         # on_bad_lines='skip' è cruciale per i file sporchi
-        df = pd.read_csv(data_io, sep=sep, skiprows=header_idx, dtype=str, on_bad_lines='skip')
-        
-        df.columns = [str(c).strip() for c in df.columns]
-        df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
-        df.dropna(how='all', inplace=True)
-        return df, "OK"
+        reader = pd.read_csv(text_io, sep=sep, skiprows=header_idx, dtype=str, on_bad_lines='skip', chunksize=chunksize)
+        return _iter_chunks(reader, text_io), "OK"
+    except Exception as e: return None, str(e)
+
+def smart_csv_loader(uploaded_file):
+    # Compatibilità: l'intero file in un solo DataFrame
+    chunks, msg = stream_csv_chunks(uploaded_file)
+    if chunks is None: return None, msg
+    try:
+        parts = list(chunks)
+        return (pd.concat(parts) if parts else pd.DataFrame()), "OK"
     except Exception as e: return None, str(e)
 
 def detect_metric_from_filename(filename):
@@ -164,98 +380,174 @@ def detect_metric_from_filename(filename):
     if "eta" in fn or "inserzi" in fn or "destinazi" in fn: return "SPECIAL_ADS_META"
     return "AUTO_DETECT" 
 
-# --- 6. SAVE BULK ---
-def save_social_bulk(df, platform, metric_hint):
-    conn = get_connection()
+# --- 6. SAVE BULK (COLONNARE) ---
+def _number_column(df, col):
+    # Valori della colonna come int Python, None per le celle non interpretabili
+    if col is None or col not in df.columns: return [0] * len(df)
+    vals, bad = clean_number_series(df[col])
+    return [None if b else v for v, b in zip(vals.tolist(), bad.tolist())]
+
+def _dedup_last(rows, key_len):
+    # Stessa semantica del vecchio DELETE+INSERT riga per riga: vince l'ultima occorrenza
+    return list({r[:key_len]: r for r in rows}.values())
+
+def build_stat_rows(df, platform, metric_hint):
+    """
+    Normalizza un export in righe (platform, metric_type, date_recorded, value) senza toccare il DB.
+    Ritorna (stat_rows, content_rows, written_rows, bad_cells); content_rows è (inventory, performance).
+    Le celle numeriche non interpretabili non vengono scritte come 0 ma contate in bad_cells;
+    written_rows conta solo le righe da scrivere (statistiche + snapshot), non quelle scartate.
+    """
+    df = df.reset_index(drop=True)
     df.columns = [c.lower().strip() for c in df.columns]
-    processed_rows = 0
+    n = len(df)
     today_str = datetime.now().strftime('%Y-%m-%d')
+    stats, inventory, perf = [], [], []
+    bad_cells = 0
+
+    # A. ADS META
+    if metric_hint == "SPECIAL_ADS_META":
+        if "nome dell'inserzione" in df.columns:
+            camps = [str(c) for c in df["nome dell'inserzione"].tolist()]
+            spend = _number_column(df, "importo speso (eur)")
+            imp = _number_column(df, "impression")
+            for camp, s, i in zip(camps, spend, imp):
+                # Salviamo come metrica social per visibilità immediata
+                stats.append(("Meta Ads", f"Spend ({camp})", today_str, s))
+                stats.append(("Meta Ads", f"Impressions ({camp})", today_str, i))
+
+    # B. CONTENT
+    elif metric_hint == "SPECIAL_CONTENT":
+        col_link = next((c for c in df.columns if "link" in c or "permalink" in c), None)
+        col_pub = next((c for c in df.columns if "post time" in c or "posted" in c or "publish" in c), None)
+        col_snap = next((c for c in df.columns if c in ["time", "date", "data"]), None)
+
+        if col_link and col_pub:
+            links = df[col_link].astype(object).map(str)
+            pids = links.str.extract(r'video/(\d+)', expand=False).fillna(
+                   links.str.extract(r'/(?:p|reel)/([^/]+)', expand=False)).fillna(links).tolist()
+            pdates = parse_date_column(df[col_pub])
+            sdates = parse_date_column(df[col_snap]) if col_snap else [today_str] * n
+            captions = [str(c) for c in df['video title'].tolist()] if 'video title' in df.columns else [''] * n
+            col_v = next((c for c in ['total views', 'views', 'impressions'] if c in df.columns), None)
+            col_l = next((c for c in ['total likes', 'likes'] if c in df.columns), None)
+            views = _number_column(df, col_v)
+            likes = _number_column(df, col_l)
+
+            for pid, link, pdate, sdate, cap, v, l in zip(pids, links.tolist(), pdates, sdates, captions, views, likes):
+                if not pdate: continue
+                inventory.append((pid, platform, pdate, cap, link))
+                # Snapshot con numeri illeggibili: il post resta in inventario ma lo snapshot si salta
+                if v is None or l is None: bad_cells += 1; continue
+                perf.append((pid, sdate, v, l, 0, 0))
+
+    # C. DEMO
+    elif metric_hint in ["SPECIAL_GENDER", "SPECIAL_GEO"]:
+        if "uomini" in df.columns and "donne" in df.columns: # IG Pivot
+            ages = [str(a) for a in df.iloc[:, 0].tolist()]
+            males = _number_column(df, 'uomini')
+            females = _number_column(df, 'donne')
+            for age, m, f in zip(ages, males, females):
+                stats.append((platform, f"Audience Gender Male ({age})", today_str, m))
+                stats.append((platform, f"Audience Gender Female ({age})", today_str, f))
+        else: # Standard
+            cat, val = df.columns[0], df.columns[1]
+            pre = "Audience Geo" if metric_hint == "SPECIAL_GEO" else "Audience Gender"
+            labels = [str(c) for c in df[cat].tolist()]
+            for lab, v in zip(labels, _number_column(df, val)):
+                stats.append((platform, f"{pre} {lab}", today_str, v))
+
+    # D. TIME SERIES (IG/TIKTOK)
+    else:
+        d_col = next((c for c in df.columns if any(x in c for x in ['date', 'data', 'time', 'giorno'])), None)
+        v_col = None
+        for c in df.columns:
+            if c != d_col: v_col = c
+
+        if d_col and v_col:
+            name = metric_hint if metric_hint != "AUTO_DETECT" else v_col.title()
+            dates = parse_date_column(df[d_col])
+            for d, v in zip(dates, _number_column(df, v_col)):
+                if not d: continue
+                if v is None: bad_cells += 1; continue
+                stats.append((platform, name, d, v))
 
+    bad_cells += sum(1 for r in stats if r[3] is None)
+    stats = [r for r in stats if r[3] is not None]
+    stats, perf = _dedup_last(stats, 3), _dedup_last(perf, 2)
+    return stats, (_dedup_last(inventory, 1), perf), len(stats) + len(perf), bad_cells
+
+def merge_stat_rows(conn, stat_rows):
+    """
+    Merge incrementale: confronta le righe in arrivo con quelle già salvate (una sola query
+    su piattaforme, metriche e intervallo date del file) e scrive solo nuove e modificate.
+    Ritorna (conteggi {'new', 'changed', 'unchanged'}, righe scritte).
+    """
+    counts = {'new': 0, 'changed': 0, 'unchanged': 0}
+    if not stat_rows: return counts, []
+    dates = [r[2] for r in stat_rows if r[2]]
+    stored = {}
+    if dates:
+        cur = conn.execute("""SELECT platform, metric_type, date_recorded, value FROM social_stats
+                              WHERE platform IN (SELECT value FROM json_each(?))
+                              AND metric_type IN (SELECT value FROM json_each(?))
+                              AND date_recorded BETWEEN ? AND ?""",
+                           (json.dumps(sorted({r[0] for r in stat_rows})), json.dumps(sorted({r[1] for r in stat_rows})), min(dates), max(dates)))
+        stored = {r[:3]: r[3] for r in cur}
+
+    delta = []
+    for r in stat_rows:
+        old = stored.get(r[:3], _MISSING)
+        if old is _MISSING: counts['new'] += 1
+        elif old != r[3]: counts['changed'] += 1
+        else: counts['unchanged'] += 1; continue
+        delta.append(r)
+    ensure_dimensions(conn, delta)
+    conn.executemany(UPSERT_STAT_SQL, delta)
+    return counts, delta
+
+def write_stat_rows(conn, stat_rows, content_rows=None):
+    # Scritture dentro la transazione del chiamante; solo il delta per social_stats e rollup
+    counts, delta = merge_stat_rows(conn, stat_rows)
+    refresh_rollups(conn, delta)
+    if content_rows:
+        inventory, perf = content_rows
+        conn.executemany("INSERT OR REPLACE INTO posts_inventory (post_id, platform, date_published, caption, link) VALUES (?,?,?,?,?)", inventory)
+        conn.executemany(UPSERT_PERF_SQL, perf)
+        conn.executemany(UPSERT_LATEST_SQL, [p for p in perf if p[1]])
+    return counts
+
+def ingest_status_msg(bad_cells, overlap=None, counts=None):
+    notes = []
+    if counts and any(counts.values()): notes.append(f"+{counts['new']} nuove, ~{counts['changed']} modificate, ={counts['unchanged']} invariate")
+    if bad_cells: notes.append(f"{bad_cells} valori non validi ignorati")
+    if overlap: notes.append(f"sovrapposto a {overlap}")
+    return f"OK ({'; '.join(notes)})" if notes else "OK"
+
+def add_counts(total, counts):
+    for k, v in counts.items(): total[k] = total.get(k, 0) + v
+    return total
+
+def save_social_stream(chunks, platform, metric_hint):
+    # Un file = una transazione, anche se arriva a blocchi (l'UPSERT mantiene "vince l'ultima")
+    written_rows = bad_cells = 0
+    counts = {}
     try:
-        # A. ADS META
-        if metric_hint == "SPECIAL_ADS_META":
-            if "nome dell'inserzione" in df.columns:
-                for _, row in df.iterrows():
-                    camp = str(row["nome dell'inserzione"])
-                    spend = clean_number(row.get("importo speso (eur)", 0))
-                    imp = clean_number(row.get("impression", 0))
-                    # Salviamo come metrica social per visibilità immediata
-                    upsert_stat(conn, "Meta Ads", f"Spend ({camp})", spend, today_str)
-                    upsert_stat(conn, "Meta Ads", f"Impressions ({camp})", imp, today_str)
-                    processed_rows += 1
-
-        # B. CONTENT
-        elif metric_hint == "SPECIAL_CONTENT":
-            col_link = next((c for c in df.columns if "link" in c or "permalink" in c), None)
-            col_pub = next((c for c in df.columns if "post time" in c or "posted" in c or "publish" in c), None)
-            col_snap = next((c for c in df.columns if c in ["time", "date", "data"]), None)
-            
-            if col_link and col_pub:
-                for _, row in df.iterrows():
-                    link = str(row[col_link])
-                    pid = link
-                    m_tk = re.search(r'video/(\d+)', link)
-                    m_ig = re.search(r'/(?:p|reel)/([^/]+)', link)
-                    if m_tk: pid = m_tk.group(1)
-                    elif m_ig: pid = m_ig.group(1)
-                    
-                    pdate = parse_smart_date(str(row[col_pub]))
-                    sdate = parse_smart_date(str(row[col_snap])) if col_snap else today_str
-                    if not pdate: continue
-
-                    try:
-                        conn.execute("INSERT OR REPLACE INTO posts_inventory (post_id, platform, date_published, caption, link) VALUES (?,?,?,?,?)", 
-                                     (pid, platform, pdate, str(row.get('video title','')), link))
-                    except: pass
-                    
-                    v = clean_number(row.get('total views', 0) or row.get('views', 0) or row.get('impressions', 0))
-                    l = clean_number(row.get('total likes', 0) or row.get('likes', 0))
-                    conn.execute("DELETE FROM posts_performance WHERE post_id=? AND date_recorded=?", (pid, sdate))
-                    conn.execute("INSERT INTO posts_performance (post_id, date_recorded, views, likes, comments, shares) VALUES (?,?,?,?,?,?)", 
-                                 (pid, sdate, v, l, 0, 0))
-                    processed_rows += 1
-
-        # C. DEMO
-        elif metric_hint in ["SPECIAL_GENDER", "SPECIAL_GEO"]:
-            if "uomini" in df.columns and "donne" in df.columns: # IG Pivot
-                for _, row in df.iterrows():
-                    age = str(row.iloc[0])
-                    upsert_stat(conn, platform, f"Audience Gender Male ({age})", clean_number(row['uomini']), today_str)
-                    upsert_stat(conn, platform, f"Audience Gender Female ({age})", clean_number(row['donne']), today_str)
-                    processed_rows += 1
-            else: # Standard
-                cat, val = df.columns[0], df.columns[1]
-                pre = "Audience Geo" if metric_hint == "SPECIAL_GEO" else "Audience Gender"
-                for _, row in df.iterrows():
-                    upsert_stat(conn, platform, f"{pre} {row[cat]}", clean_number(row[val]), today_str)
-                    processed_rows += 1
-
-        # D. TIME SERIES (IG/TIKTOK)
-        else:
-            d_col = next((c for c in df.columns if any(x in c for x in ['date', 'data', 'time', 'giorno'])), None)
-            v_col = None
-            for c in df.columns:
-                if c != d_col: v_col = c
-            
-            if d_col and v_col:
-                for _, row in df.iterrows():
-                    d = parse_smart_date(str(row[d_col]))
-                    if not d: continue
-                    val = clean_number(row[v_col])
-                    name = metric_hint if metric_hint != "AUTO_DETECT" else v_col.title()
-                    upsert_stat(conn, platform, name, val, d)
-                    processed_rows += 1
-
-        conn.commit()
+        with db_session() as conn:
+            for df in chunks:
+                stat_rows, content_rows, rows, bad = build_stat_rows(df, platform, metric_hint)
+                add_counts(counts, write_stat_rows(conn, stat_rows, content_rows))
+                written_rows += rows; bad_cells += bad
+        bump_generation()
     except Exception as e:
-        conn.close()
         return 0, str(e)
-    
-    conn.close()
-    return processed_rows, "OK"
+    return written_rows, ingest_status_msg(bad_cells, counts=counts)
+
+def save_social_bulk(df, platform, metric_hint):
+    return save_social_stream([df], platform, metric_hint)
 
 def upsert_stat(conn, platform, metric, value, date_val):
     try:
-        conn.execute("DELETE FROM social_stats WHERE platform=? AND metric_type=? AND date_recorded=?", (platform, metric, date_val))
-        conn.execute("INSERT INTO social_stats (platform, metric_type, value, date_recorded, source_type) VALUES (?,?,?,?,?)", (platform, metric, value, date_val, 'csv_gen'))
+        ensure_dimensions(conn, [(platform, metric)])
+        conn.execute(UPSERT_STAT_SQL, (platform, metric, date_val, value))
     except: pass
\ No newline at end of file
@@ -1,6 +1,6 @@
 import requests
 import base64
-from database import get_connection
+from database import db_session
 
 class SpotifyAPI:
     # URL UFFICIALI SPOTIFY
@@ -9,11 +9,11 @@ class SpotifyAPI:
     BASE_URL = "https://api.spotify.com/v1"
 
     def __init__(self): 
-        conn=get_connection(); r=conn.execute("SELECT client_id,client_secret,access_token FROM api_credentials WHERE platform='spotify'").fetchone(); conn.close()
+        with db_session() as conn: r=conn.execute("SELECT client_id,client_secret,access_token FROM api_credentials WHERE platform='spotify'").fetchone()
         self.cid,self.csec,self.tok=r if r else (None,None,None)
         
     def save(self,i,s): 
-        conn=get_connection(); conn.execute("INSERT OR REPLACE INTO api_credentials (platform,client_id,client_secret) VALUES ('spotify',?,?)",(i,s)); conn.commit(); conn.close()
+        with db_session() as conn: conn.execute("INSERT OR REPLACE INTO api_credentials (platform,client_id,client_secret) VALUES ('spotify',?,?)",(i,s))
         
     def get_auth(self): 
         # Redirect URI deve combaciare con quello nelle impostazioni developer di Spotify
@@ -28,7 +28,7 @@ class SpotifyAPI:
             r=requests.post(self.TOKEN_URL, headers=headers, data=data)
             if r.status_code==200: 
                 token = r.json()['access_token']
-                conn=get_connection(); conn.execute("UPDATE api_credentials SET access_token=? WHERE platform='spotify'",(token,)); conn.commit(); conn.close()
+                with db_session() as conn: conn.execute("UPDATE api_credentials SET access_token=? WHERE platform='spotify'",(token,))
                 return True
             return False
         except: return False
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# I moduli stanno nella root del progetto (nessun pacchetto installato)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+import database
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """DB vuoto in una cartella temporanea (DB_NAME è relativo alla cwd), cache e pool azzerati."""
+    monkeypatch.chdir(tmp_path)
+    database.close_connections()
+    database._schema_ready.clear()
+    database.bump_generation()
+    yield tmp_path / database.DB_NAME
+    database.close_connections()
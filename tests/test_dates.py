@@ -0,0 +1,21 @@
+from datetime import date
+import pandas as pd
+from social_logic import parse_date_column, parse_smart_date
+
+TODAY = date(2024, 3, 15)
+
+def test_formato_rilevato_dal_campione():
+    assert parse_date_column(pd.Series(["31/01/2024", "01/02/2024"]), TODAY) == ["2024-01-31", "2024-02-01"]
+    assert parse_date_column(pd.Series(["2024.01.31"]), TODAY) == [None]  # nessun formato noto
+    assert parse_date_column(pd.Series(["31.01.2024", "1.02.2024"]), TODAY) == ["2024-01-31", "2024-02-01"]
+
+def test_iso_con_orario():
+    assert parse_date_column(pd.Series(["2024-01-31T10:00:00", "2024-02-01T23:59:00"]), TODAY) == ["2024-01-31", "2024-02-01"]
+
+def test_date_testuali_e_anno():
+    # A marzo "12 ott" è dell'anno precedente; "ott"/"set" non vengono troncati dalla 't'
+    assert parse_date_column(pd.Series(["12 ott", "3 gen"]), TODAY) == ["2023-10-12", "2024-01-03"]
+
+def test_colonna_mista_come_parser_scalare():
+    col = ["2024-01-05", "5 feb", "", "non una data", None, "2024-01-06T08:00"]
+    assert parse_date_column(pd.Series(col), TODAY) == [parse_smart_date(x, TODAY) if x else None for x in col]
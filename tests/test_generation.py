@@ -0,0 +1,32 @@
+import time
+from generation_logic import GenerationService
+from llm_backend import FakeBackend
+
+def _msg(text):
+    return [{"role": "user", "content": text}]
+
+def _attendi(job, timeout=10):
+    t = time.time()
+    while job.status in ("queued", "running") and time.time() - t < timeout: time.sleep(0.01)
+    return job.status
+
+def test_coda_piena_non_annulla_la_generazione_in_corso():
+    # ~1s per risposta, un worker, un solo posto in coda
+    svc = GenerationService(backend=FakeBackend(tps=50, ttft=0, replay_path=None, tokens=50), workers=1, queue_max=1)
+    a = svc.submit("s1", _msg("a"), "fake")
+    while a.status == "queued": time.sleep(0.01)
+    b = svc.submit("s2", _msg("b"), "fake")
+    c = svc.submit("s1", _msg("c"), "fake")
+    assert (a.status, b.status, c.status) == ("running", "queued", "rejected")
+    assert svc.active_job("s1") is a
+
+    # Un nuovo prompt accettato annulla il precedente della stessa sessione
+    assert svc.cancel(a.id)
+    assert _attendi(a) == "cancelled"
+    while b.status == "queued": time.sleep(0.01)
+    seen = []
+    d = svc.submit("s2", _msg("d"), "fake", on_done=lambda job: seen.append((job.outcome, job.status)))
+    assert _attendi(b) == "cancelled"
+    assert _attendi(d) == "done" and d.text
+    # on_done vede l'esito prima che lo stato diventi finale per la UI
+    assert seen == [("done", "running")]
@@ -0,0 +1,26 @@
+import sqlite3
+import database
+from rollup_logic import get_trend, get_audience_latest
+
+def _vecchio_db(path, rows):
+    # Schema di partenza (prima delle migrazioni) con date già salvate dal vecchio parser
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE social_stats (id INTEGER PRIMARY KEY AUTOINCREMENT, platform TEXT, metric_type TEXT,
+                    value REAL, date_recorded DATE, source_type TEXT)""")
+    conn.executemany("INSERT INTO social_stats (platform, metric_type, value, date_recorded, source_type) VALUES (?,?,?,?,'CSV')", rows)
+    conn.commit()
+    conn.close()
+
+def test_migrazione_ricostruisce_i_rollup(db):
+    _vecchio_db(db, [("IG", "Follower", 10, "2024-01-05"), ("IG", "Follower", 30, "2024-01-20"),
+                     ("IG", "Follower", 5, "2024-02-01"), ("IG", "Follower", 99, "da"),
+                     ("IG", "Audience Gender Female (25-34)", 40, "2024-02-01"),
+                     ("IG", "Audience Gender Female (25-34)", 7, "da")])
+    database.init_advanced_db()
+
+    df = get_trend(("IG",), ("Follower",), "M")
+    assert df['date_recorded'].dt.strftime('%Y-%m-%d').tolist() == ["2024-01-01", "2024-02-01"]
+    assert df['value_sum'].tolist() == [40, 5]
+    assert df['value_last'].tolist() == [30, 5]
+    aud = get_audience_latest(("IG",))
+    assert aud[['label', 'value', 'date_recorded']].values.tolist() == [["Female (25-34)", 40, "2024-02-01"]]
@@ -0,0 +1,141 @@
+import os
+import json
+import shutil
+from datetime import date, datetime, timedelta
+import pandas as pd
+from database import db_session, cached_read, bump_generation, data_fingerprint
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # opzionale: senza pyarrow le letture ripiegano su SQLite
+    pa = None
+
+# --- 1. CONFIGURAZIONE ---
+WAREHOUSE_DIR = "warehouse"
+META_FILE = "_snapshot.json"
+EXPORT_CHUNKSIZE = 200000
+PARTITION_COLS = ["platform", "month"]
+# tabella -> (query di export, colonna data che decide la partizione mensile)
+TABLES = {
+    "social_stats": ("SELECT platform, metric_type, value, date_recorded, source_type FROM social_stats", "date_recorded"),
+    "posts_performance": ("""SELECT i.platform, p.post_id, p.date_recorded, p.views, p.likes, p.comments, p.shares
+                             FROM posts_performance p LEFT JOIN posts_inventory i ON i.post_id = p.post_id""", "date_recorded"),
+    "campaigns": ("SELECT * FROM campaigns", "start_date"),
+}
+
+def available():
+    return pa is not None
+
+def _partitioning():
+    return ds.partitioning(pa.schema([("platform", pa.string()), ("month", pa.string())]), flavor="hive")
+
+# --- 2. EXPORT ---
+def _numeric_cols(conn, table):
+    # Tipi dichiarati in SQLite: un blocco tutto NULL non deve cambiare lo schema Parquet
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})") if (r[2] or "").upper() in ("INTEGER", "REAL")}
+
+def _to_arrow(df, date_col, numeric):
+    # Numeri -> float64, tutto il resto -> stringa (None resta null)
+    df = df.copy()
+    df['platform'] = df['platform'].fillna("n/a").astype(str)
+    df['month'] = df[date_col].map(lambda d: str(d)[:7] if pd.notna(d) else "n/a")
+    fields = []
+    for col in df.columns:
+        if col in numeric:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype("float64"); fields.append((col, pa.float64()))
+        else:
+            df[col] = df[col].astype(object).map(lambda v: str(v) if pd.notna(v) else None)
+            fields.append((col, pa.string()))
+    return pa.Table.from_pandas(df, schema=pa.schema(fields), preserve_index=False)
+
+def export_snapshot(root=WAREHOUSE_DIR, chunksize=EXPORT_CHUNKSIZE):
+    """
+    Scrive social_stats, posts_performance e campaigns in Parquet partizionato per piattaforma e mese
+    (root/<tabella>/platform=X/month=YYYY-MM/). Lo snapshot nuovo sostituisce il vecchio solo a fine export.
+    Nei metadati salva la versione dei dati (data_fingerprint) letta prima dell'export.
+    Ritorna (ok, righe per tabella | messaggio).
+    """
+    if pa is None: return False, "pyarrow non installato"
+    tmp, old = root + ".tmp", root + ".old"
+    shutil.rmtree(tmp, ignore_errors=True)
+    counts = {}
+    try:
+        version = data_fingerprint()  # letta prima: una scrittura durante l'export rende lo snapshot vecchio, non il contrario
+        with db_session() as conn:
+            for name, (sql, date_col) in TABLES.items():
+                counts[name] = 0
+                numeric = _numeric_cols(conn, name)
+                for i, df in enumerate(pd.read_sql_query(sql, conn, chunksize=chunksize)):
+                    if df.empty: continue
+                    pq.write_to_dataset(_to_arrow(df, date_col, numeric), os.path.join(tmp, name), partition_cols=PARTITION_COLS,
+                                        basename_template=f"part-{i}-{{i}}.parquet")
+                    counts[name] += len(df)
+        os.makedirs(tmp, exist_ok=True)
+        with open(os.path.join(tmp, META_FILE), "w") as f:
+            json.dump({"created": datetime.now().isoformat(timespec="seconds"), "rows": counts, "version": version}, f)
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.isdir(root): os.rename(root, old)
+        os.rename(tmp, root)
+        shutil.rmtree(old, ignore_errors=True)
+        bump_generation() # le letture dallo snapshot (contesto AI) vanno rifatte
+    except Exception as e:
+        shutil.rmtree(tmp, ignore_errors=True)
+        return False, str(e)
+    return True, counts
+
+# --- 3. LETTURA (COLONNARE) ---
+def snapshot_info(root=WAREHOUSE_DIR):
+    try:
+        with open(os.path.join(root, META_FILE)) as f: return json.load(f)
+    except: return None
+
+def snapshot_fresh(info=None, root=WAREHOUSE_DIR):
+    # Lo snapshot vale solo se i dati non sono cambiati dall'export (snapshot senza versione = vecchi)
+    info = info or snapshot_info(root)
+    return bool(info) and info.get("version") == data_fingerprint()
+
+def read_snapshot(table, columns=None, platforms=None, months=None, root=WAREHOUSE_DIR):
+    """
+    Legge dallo snapshot solo le colonne e le partizioni richieste (file mappati in memoria).
+    platforms/months ('YYYY-MM') filtrano le cartelle prima di aprire i file.
+    Ritorna None se lo snapshot o pyarrow non ci sono, così il chiamante può usare SQLite.
+    """
+    path = os.path.join(root, table)
+    if pa is None or not os.path.isdir(path): return None
+    filters = []
+    if platforms: filters.append(("platform", "in", list(platforms)))
+    if months: filters.append(("month", "in", list(months)))
+    tbl = pq.read_table(path, columns=list(columns) if columns else None, filters=filters or None,
+                        partitioning=_partitioning(), memory_map=True)
+    return tbl.to_pandas()
+
+def _months_back(n, today=None):
+    d = (today or date.today()).replace(day=1)
+    out = []
+    for _ in range(n):
+        out.append(d.strftime("%Y-%m"))
+        d = (d - timedelta(days=1)).replace(day=1)
+    return out
+
+@cached_read()
+def get_social_context(platforms=None, months=3, max_lines=40):
+    """
+    Riassunto testuale delle serie social per il prompt AI: ultimo valore e variazione per
+    piattaforma/metrica negli ultimi mesi. Usa lo snapshot Parquet se è aggiornato, altrimenti SQLite.
+    """
+    cols = ["platform", "metric_type", "value", "date_recorded"]
+    df = read_snapshot("social_stats", cols, platforms, _months_back(months)) if snapshot_fresh() else None
+    if df is None:
+        from social_logic import query_stats, get_platforms
+        start = _months_back(months)[-1] + "-01"
+        df = query_stats(tuple(platforms or get_platforms()), (), start, None, limit=-1)
+    if df is None or df.empty: return ""
+    df = df[~df['metric_type'].str.startswith("Audience")].sort_values("date_recorded")
+    lines = []
+    for (plat, met), g in df.groupby(["platform", "metric_type"]):
+        first, last = g.iloc[0], g.iloc[-1]
+        delta = last['value'] - first['value']
+        lines.append(f"- {plat} | {met}: {last['value']:,.0f} al {str(last['date_recorded'])[:10]} ({delta:+,.0f} dal {str(first['date_recorded'])[:10]})")
+    return "\n".join(lines[:max_lines])